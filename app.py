@@ -1,14 +1,20 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
-from datetime import datetime, date, timedelta
+import numpy as np
+from datetime import datetime, date
 import io
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+import xlsxwriter
 import hashlib
-import time
 import secrets
 import json
+import threading
+import queue
+from contextlib import contextmanager
+from PIL import Image, ImageOps
 
 # Page configuration
 st.set_page_config(
@@ -17,17 +23,6 @@ st.set_page_config(
     layout="wide"
 )
 
-# Custom CSS
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #1f77b4;
-    }
-</style>
-""", unsafe_allow_html=True)
-
 # USER ROLES
 USER_ROLES = {
     "hr": {
@@ -52,6 +47,36 @@ USER_ROLES = {
     }
 }
 
+def get_role_pages(role):
+    """Navigation entries available to a role"""
+    page_options = ["➕ Add Expense"]
+    
+    if role == "hr":
+        page_options.extend(["📝 My Expenses", "🔐 Change Password"])
+    else:
+        if role in ["brand_heads", "admin"]:
+            page_options.append("✅ Approval Stage 1 (Brand Head)")
+        
+        if role in ["stage2_approver", "admin"]:
+            page_options.append("✅ Approval Stage 2 (Senior Manager)")
+        
+        if role in ["accounts_team", "admin"]:
+            page_options.append("💳 Approval Stage 3 (Accounts Payment)")
+        
+        # Dashboard only for stage2_approver, accounts_team, and admin
+        if role in ["stage2_approver", "accounts_team", "admin"]:
+            page_options.append("📊 Dashboard")
+        
+        page_options.extend(["📋 View All Expenses", "🔐 Change Password"])
+    
+    if role == "admin":
+        page_options.append("👥 User Management")
+    
+    return page_options
+
+# Navigation entries per role, built once at import instead of on every rerun
+ROLE_PAGES = {role: get_role_pages(role) for role in USER_ROLES}
+
 # Brand list
 BRANDS = [
     "Central", "FundoBaBa", "Salary Adda", "FastPaise", "SnapPaisa", "Salary 4 Sure",
@@ -77,148 +102,289 @@ CATEGORIES = {
     "Others": []
 }
 
+# Hashed lookups for validating uploaded values against the lists above
+BRAND_SET = frozenset(BRANDS)
+SUBCATEGORY_SETS = {category: frozenset(subs) for category, subs in CATEGORIES.items()}
+
 PAYMENT_MODES = ["Cash", "Bank Transfer", "Cheque", "UPI", "Card", "Other"]
 
+# Status filter options and their SQL conditions
+STATUS_FILTERS = {
+    "Stage 1 Pending": "stage1_status = 'Pending'",
+    "Stage 2 Pending": "stage1_status = 'Approved' AND stage2_status = 'Pending'",
+    "Payment Pending": "stage1_status = 'Approved' AND stage2_status = 'Approved' AND stage3_status = 'Pending'",
+    "Paid": "stage3_status = 'Paid'",
+    "Rejected": "stage1_status = 'Rejected' OR stage2_status = 'Rejected' OR stage3_status = 'Rejected'"
+}
+
+# Expense columns read by the pages (bill bytes are fetched separately via get_bill_document)
+EXPENSE_COLUMNS = """
+    id, date, brand, category, subcategory, amount, description, bill_filename, bill_filetype,
+    added_by, vendor_name, due_date, stage1_assigned_to, stage1_status, stage1_approved_by,
+    stage1_approved_date, stage1_remarks, stage2_status, stage2_approved_by, stage2_approved_date,
+    stage2_remarks, stage3_status, stage3_paid_by, stage3_paid_date, stage3_payment_mode,
+    stage3_transaction_ref, stage3_remarks, created_at
+"""
+
+# Pending queue of each approval stage, oldest first (built once, so every call reuses the same cached statement)
+PENDING_QUERIES = {
+    1: f"""
+        SELECT {EXPENSE_COLUMNS} FROM expenses 
+        WHERE stage1_status = 'Pending' 
+        ORDER BY created_at ASC
+    """,
+    2: f"""
+        SELECT {EXPENSE_COLUMNS} FROM expenses 
+        WHERE stage1_status = 'Approved' AND stage2_status = 'Pending' 
+        ORDER BY created_at ASC
+    """,
+    3: f"""
+        SELECT {EXPENSE_COLUMNS} FROM expenses 
+        WHERE stage1_status = 'Approved' AND stage2_status = 'Approved' 
+        AND stage3_status = 'Pending' 
+        ORDER BY created_at ASC
+    """
+}
+PENDING_ASSIGNED_QUERY = f"""
+    SELECT {EXPENSE_COLUMNS} FROM expenses 
+    WHERE stage1_status = 'Pending' AND stage1_assigned_to = ?
+    ORDER BY created_at ASC
+"""
+
 # Database setup
+def open_connection():
+    """Open a tuned SQLite connection to the expenses database"""
+    conn = sqlite3.connect('expenses.db', timeout=30, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    
+    # Tune once per connection: WAL journal + relaxed fsync, in-memory temp tables, larger page cache
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    # Enforce the session_tokens -> users and expense_bills -> expenses references
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+@st.cache_resource
+def get_read_pool(size=4):
+    """Get the pool of reader connections (reused across reruns and sessions)"""
+    pool = queue.Queue(maxsize=size)
+    for _ in range(size):
+        pool.put(open_connection())
+    return pool
+
+@contextmanager
+def read_conn():
+    """Borrow a reader connection from the pool for the duration of the block"""
+    pool = get_read_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+@st.cache_resource
+def get_write_conn():
+    """Get the dedicated writer connection; use it only while holding get_write_lock()"""
+    return open_connection()
+
+@st.cache_resource
+def get_write_lock():
+    """Lock serializing writes on the writer connection (Streamlit runs sessions in threads)"""
+    return threading.Lock()
+
+# Bump whenever init_db() gains a table, column or index, so existing databases run it again
+SCHEMA_VERSION = 2
+
 def init_db():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    # Users table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            full_name TEXT NOT NULL,
-            role TEXT NOT NULL,
-            is_active INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by TEXT
-        )
-    ''')
-    
-    # Session tokens table for persistent login
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS session_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            token TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP NOT NULL,
-            is_valid INTEGER DEFAULT 1,
-            FOREIGN KEY (username) REFERENCES users(username)
-        )
-    ''')
-    
-    # default admin user
-    c.execute("SELECT * FROM users WHERE username = 'admin'")
-    if not c.fetchone():
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        
+        # A database already migrated to this version needs no introspection or DDL
+        if c.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        
+        # Users table
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                full_name TEXT NOT NULL,
+                role TEXT NOT NULL,
+                is_active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_by TEXT
+            )
+        ''')
+        
+        # Session tokens table for persistent login
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS session_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                token TEXT UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL,
+                is_valid INTEGER DEFAULT 1,
+                FOREIGN KEY (username) REFERENCES users(username)
+            )
+        ''')
+        
+        # default admin user (UNIQUE username makes this a no-op once it exists)
         admin_password = hashlib.sha256('admin123'.encode()).hexdigest()
         c.execute('''
-            INSERT INTO users (username, password, full_name, role, created_by)
+            INSERT OR IGNORE INTO users (username, password, full_name, role, created_by)
             VALUES (?, ?, ?, ?, ?)
         ''', ('admin', admin_password, 'System Administrator', 'admin', 'system'))
-    
-    # Expenses table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS expenses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date DATE NOT NULL,
-            brand TEXT NOT NULL,
-            category TEXT NOT NULL,
-            subcategory TEXT,
-            amount REAL NOT NULL,
-            description TEXT,
-            bill_document BLOB,
-            bill_filename TEXT,
-            bill_filetype TEXT,
-            added_by TEXT,
-            stage1_assigned_to TEXT,
-            stage1_status TEXT DEFAULT 'Pending',
-            stage1_approved_by TEXT,
-            stage1_approved_date TIMESTAMP,
-            stage1_remarks TEXT,
-            stage2_status TEXT DEFAULT 'Pending',
-            stage2_approved_by TEXT,
-            stage2_approved_date TIMESTAMP,
-            stage2_remarks TEXT,
-            stage3_status TEXT DEFAULT 'Pending',
-            stage3_paid_by TEXT,
-            stage3_paid_date TIMESTAMP,
-            stage3_payment_mode TEXT,
-            stage3_transaction_ref TEXT,
-            stage3_remarks TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Check and add missing columns
-    c.execute("PRAGMA table_info(expenses)")
-    columns = [col[1] for col in c.fetchall()]
-    
-    if 'stage1_assigned_to' not in columns:
-        try:
-            c.execute("ALTER TABLE expenses ADD COLUMN stage1_assigned_to TEXT")
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
-    
-    if 'subcategory' not in columns:
-        try:
-            c.execute("ALTER TABLE expenses ADD COLUMN subcategory TEXT")
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
-    
-    if 'bill_document' not in columns:
-        try:
-            c.execute("ALTER TABLE expenses ADD COLUMN bill_document BLOB")
-            c.execute("ALTER TABLE expenses ADD COLUMN bill_filename TEXT")
-            c.execute("ALTER TABLE expenses ADD COLUMN bill_filetype TEXT")
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
-    
-    if 'vendor_name' not in columns:
-        try:
-            c.execute("ALTER TABLE expenses ADD COLUMN vendor_name TEXT")
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
-    
-    if 'due_date' not in columns:
-        try:
-            c.execute("ALTER TABLE expenses ADD COLUMN due_date DATE")
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
-    
-    conn.commit()
-    conn.close()
+        
+        # Expenses table
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS expenses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date DATE NOT NULL,
+                brand TEXT NOT NULL,
+                category TEXT NOT NULL,
+                subcategory TEXT,
+                amount REAL NOT NULL,
+                description TEXT,
+                bill_filename TEXT,
+                bill_filetype TEXT,
+                added_by TEXT,
+                stage1_assigned_to TEXT,
+                stage1_status TEXT DEFAULT 'Pending',
+                stage1_approved_by TEXT,
+                stage1_approved_date TIMESTAMP,
+                stage1_remarks TEXT,
+                stage2_status TEXT DEFAULT 'Pending',
+                stage2_approved_by TEXT,
+                stage2_approved_date TIMESTAMP,
+                stage2_remarks TEXT,
+                stage3_status TEXT DEFAULT 'Pending',
+                stage3_paid_by TEXT,
+                stage3_paid_date TIMESTAMP,
+                stage3_payment_mode TEXT,
+                stage3_transaction_ref TEXT,
+                stage3_remarks TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Check and add missing columns
+        c.execute("PRAGMA table_info(expenses)")
+        columns = [col[1] for col in c.fetchall()]
+        
+        if 'stage1_assigned_to' not in columns:
+            try:
+                c.execute("ALTER TABLE expenses ADD COLUMN stage1_assigned_to TEXT")
+                conn.commit()
+            except sqlite3.OperationalError:
+                pass
+        
+        if 'subcategory' not in columns:
+            try:
+                c.execute("ALTER TABLE expenses ADD COLUMN subcategory TEXT")
+                conn.commit()
+            except sqlite3.OperationalError:
+                pass
+        
+        if 'bill_filename' not in columns:
+            try:
+                c.execute("ALTER TABLE expenses ADD COLUMN bill_filename TEXT")
+                c.execute("ALTER TABLE expenses ADD COLUMN bill_filetype TEXT")
+                conn.commit()
+            except sqlite3.OperationalError:
+                pass
+        
+        if 'vendor_name' not in columns:
+            try:
+                c.execute("ALTER TABLE expenses ADD COLUMN vendor_name TEXT")
+                conn.commit()
+            except sqlite3.OperationalError:
+                pass
+        
+        if 'due_date' not in columns:
+            try:
+                c.execute("ALTER TABLE expenses ADD COLUMN due_date DATE")
+                conn.commit()
+            except sqlite3.OperationalError:
+                pass
+        
+        # Bill documents live in their own table so expense scans don't page through BLOBs
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS expense_bills (
+                expense_id INTEGER PRIMARY KEY,
+                bill_document BLOB NOT NULL,
+                FOREIGN KEY (expense_id) REFERENCES expenses(id)
+            )
+        ''')
+        
+        # Move bills still stored inline on expenses into expense_bills, then drop the legacy column
+        if 'bill_document' in columns:
+            c.execute("BEGIN")
+            with conn:
+                c.execute('''
+                    INSERT OR IGNORE INTO expense_bills (expense_id, bill_document)
+                    SELECT id, bill_document FROM expenses WHERE bill_document IS NOT NULL
+                ''')
+                c.execute("UPDATE expenses SET bill_document = NULL WHERE bill_document IS NOT NULL")
+            try:
+                c.execute("ALTER TABLE expenses DROP COLUMN bill_document")
+            except sqlite3.OperationalError:
+                # SQLite older than 3.35 cannot drop columns; the emptied column is harmless
+                pass
 
-def add_vendor_column():
-    """Add vendor column to expenses table if it doesn't exist"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    # Check if vendor column exists
-    c.execute("PRAGMA table_info(expenses)")
-    columns = [col[1] for col in c.fetchall()]
-    
-    if 'vendor_name' not in columns:
-        try:
-            c.execute("ALTER TABLE expenses ADD COLUMN vendor_name TEXT")
-            conn.commit()
-            print("Vendor column added successfully")
-        except sqlite3.OperationalError:
-            pass
-    
-    conn.close()
+        # Indexes for brand/category/date aggregations and date-range filters
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_brand_date_amt ON expenses(brand, date, amount)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_cat_date_amt ON expenses(category, date, amount)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_date ON expenses(date)")
+        
+        # Indexes for the per-stage pending queues (ordered by created_at) and My Expenses
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_stage1_pending ON expenses(stage1_status, stage1_assigned_to, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_stage2_pending ON expenses(stage2_status, stage1_status, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_stage3_pending ON expenses(stage3_status, stage2_status, stage1_status, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_added_by ON expenses(added_by, created_at)")
+        
+        # Indexes for each approver's history tab (ordered by decision date)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_stage1_history ON expenses(stage1_approved_by, stage1_approved_date)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_stage2_history ON expenses(stage2_approved_by, stage2_approved_date)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_stage3_history ON expenses(stage3_paid_by, stage3_paid_date)")
+        
+        # Brand heads' View All list and its date span are scoped to their assigned expenses
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_assigned_date ON expenses(stage1_assigned_to, date)")
+        
+        # Covers the Dashboard/View All metrics (total, paid/pending, with bills) so they read this narrow index, not the table
+        c.execute("CREATE INDEX IF NOT EXISTS idx_exp_metrics ON expenses(stage3_status, amount, bill_filename)")
+
+        # Gather planner statistics once (sqlite_stat1 only exists after the first ANALYZE)
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        if not c.fetchone():
+            c.execute("ANALYZE")
+
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+@st.cache_resource
+def bootstrap_db():
+    """Create/migrate the schema once per server process instead of on every rerun"""
+    init_db()
+    return True
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def optimize_db():
+    """Refresh query planner statistics (runs at most once an hour)"""
+    conn = get_write_conn()
+    with get_write_lock():
+        conn.execute("PRAGMA optimize")
+    return True
 
 # Initialize database
-init_db()
-add_vendor_column()
+bootstrap_db()
+optimize_db()
 
 # Session Token Management Functions
 def create_session_token(username, remember_me=False):
@@ -227,81 +393,71 @@ def create_session_token(username, remember_me=False):
     
     # Token expires in 30 days if remember_me, otherwise 1 day
     expiry_days = 30 if remember_me else 1
-    expires_at = datetime.now() + timedelta(days=expiry_days)
-    
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    # Invalidate old tokens for this user
-    c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
     
-    # Create new token
-    c.execute('''
-        INSERT INTO session_tokens (username, token, expires_at)
-        VALUES (?, ?, ?)
-    ''', (username, token, expires_at))
-    
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            # Invalidate old tokens for this user
+            c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
+            
+            # Create new token
+            c.execute('''
+                INSERT INTO session_tokens (username, token, expires_at)
+                VALUES (?, ?, datetime('now', ?))
+            ''', (username, token, f'+{expiry_days} days'))
     
     return token
 
 def verify_session_token(token):
     """Verify if a session token is valid and return user data"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    # SQLite's datetime comparison 
-    c.execute('''
-        SELECT st.username, u.full_name, u.role
-        FROM session_tokens st
-        JOIN users u ON st.username = u.username
-        WHERE st.token = ? 
-        AND st.is_valid = 1 
-        AND u.is_active = 1
-        AND datetime(st.expires_at) > datetime('now')
-    ''', (token,))
-    
-    result = c.fetchone()
-    conn.close()
-    
-    if result:
-        username, full_name, role = result
-        return {
-            'username': username,
-            'full_name': full_name,
-            'role': role
-        }
-    
-    return None
+    with read_conn() as conn:
+        c = conn.cursor()
+        
+        # SQLite's datetime comparison 
+        c.execute('''
+            SELECT st.username, u.full_name, u.role
+            FROM session_tokens st
+            JOIN users u ON st.username = u.username
+            WHERE st.token = ? 
+            AND st.is_valid = 1 
+            AND u.is_active = 1
+            AND datetime(st.expires_at) > datetime('now')
+        ''', (token,))
+        
+        result = c.fetchone()
+        
+        # sqlite3.Row maps straight to the username/full_name/role dict callers expect
+        return dict(result) if result else None
 
 def invalidate_session_token(token):
     """Invalidate a session token"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute("UPDATE session_tokens SET is_valid = 0 WHERE token = ?", (token,))
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("UPDATE session_tokens SET is_valid = 0 WHERE token = ?", (token,))
+        conn.commit()
 
 def invalidate_all_user_tokens(username):
     """Invalidate all session tokens for a user"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
+        conn.commit()
 
 def cleanup_expired_tokens():
     """Clean up expired tokens from database"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''
-        UPDATE session_tokens 
-        SET is_valid = 0 
-        WHERE expires_at < datetime('now') AND is_valid = 1
-    ''')
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute('''
+            UPDATE session_tokens 
+            SET is_valid = 0 
+            WHERE expires_at < datetime('now') AND is_valid = 1
+        ''')
+        conn.commit()
 
 # token retrieval function
 def get_saved_token():
@@ -340,143 +496,223 @@ def authenticate_user(username, password):
     """Authenticate user with username and password"""
     hashed_password = hashlib.sha256(password.encode()).hexdigest()
     
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute("""
-        SELECT username, full_name, role 
-        FROM users 
-        WHERE username = ? AND password = ? AND is_active = 1
-    """, (username, hashed_password))
-    result = c.fetchone()
-    conn.close()
-    
-    return result
+    with read_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT username, full_name, role 
+            FROM users 
+            WHERE username = ? AND password = ? AND is_active = 1
+        """, (username, hashed_password))
+        result = c.fetchone()
+        
+        # Same username/full_name/role dict as verify_session_token
+        return dict(result) if result else None
 
 def create_user(username, password, full_name, role, created_by):
     """Create a new user"""
     hashed_password = hashlib.sha256(password.encode()).hexdigest()
     
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    try:
-        c.execute('''
-            INSERT INTO users (username, password, full_name, role, created_by)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (username, hashed_password, full_name, role, created_by))
-        conn.commit()
-        conn.close()
-        return True, "User created successfully"
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False, "Username already exists"
-    except Exception as e:
-        conn.close()
-        return False, str(e)
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        try:
+            c.execute('''
+                INSERT INTO users (username, password, full_name, role, created_by)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (username, hashed_password, full_name, role, created_by))
+            conn.commit()
+            clear_user_caches()
+            return True, "User created successfully"
+        except sqlite3.IntegrityError:
+            return False, "Username already exists"
+        except Exception as e:
+            return False, str(e)
 
+@st.cache_data(ttl=300, show_spinner=False)
 def get_all_users():
     """Get all users"""
-    conn = sqlite3.connect('expenses.db')
-    df = pd.read_sql_query("""
-        SELECT id, username, full_name, role, is_active, created_at, created_by
-        FROM users
-        ORDER BY created_at DESC
-    """, conn)
-    conn.close()
-    return df
+    with read_conn() as conn:
+        df = pd.read_sql_query("""
+            SELECT id, username, full_name, role, is_active, created_at, created_by
+            FROM users
+            ORDER BY created_at DESC
+        """, conn)
+        return df
 
 def update_user_status(user_id, is_active):
     """Activate/Deactivate user"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute("UPDATE users SET is_active = ? WHERE id = ?", (is_active, user_id))
-    
-    # If deactivating, also invalidate their tokens
-    if not is_active:
-        c.execute("""
-            UPDATE session_tokens 
-            SET is_valid = 0 
-            WHERE username = (SELECT username FROM users WHERE id = ?)
-        """, (user_id,))
-    
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            c.execute("UPDATE users SET is_active = ? WHERE id = ?", (is_active, user_id))
+            
+            # If deactivating, also invalidate their tokens
+            if not is_active:
+                c.execute("""
+                    UPDATE session_tokens 
+                    SET is_valid = 0 
+                    WHERE username = (SELECT username FROM users WHERE id = ?)
+                """, (user_id,))
+    clear_user_caches()
 
 def delete_user(user_id):
     """Delete user"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    # Get username first
-    c.execute("SELECT username FROM users WHERE id = ?", (user_id,))
-    result = c.fetchone()
-    
-    if result:
-        username = result[0]
-        # Invalidate all tokens
-        c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
-        # Delete user
-        c.execute("DELETE FROM users WHERE id = ? AND username != 'admin'", (user_id,))
-    
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            # Get username first
+            c.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+            result = c.fetchone()
+            
+            if result and result[0] != 'admin':
+                username = result[0]
+                # Remove their tokens first (session_tokens references users)
+                c.execute("DELETE FROM session_tokens WHERE username = ?", (username,))
+                # Delete user
+                c.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    clear_user_caches()
 
 def reset_user_password(user_id, new_password):
     """Reset user password"""
     hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
     
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    # Get username
-    c.execute("SELECT username FROM users WHERE id = ?", (user_id,))
-    result = c.fetchone()
-    
-    if result:
-        username = result[0]
-        # Update password
-        c.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_password, user_id))
-        # Invalidate all existing tokens
-        c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
-    
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            # Get username
+            c.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+            result = c.fetchone()
+            
+            if result:
+                username = result[0]
+                # Update password
+                c.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_password, user_id))
+                # Invalidate all existing tokens
+                c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
 
 # Expense Functions
+def compress_bill(bill_document, bill_filename, bill_filetype, max_size=1600, min_bytes=200 * 1024):
+    """Downscale and re-encode image bills as JPEG (PDFs and small files are stored as-is)"""
+    if not bill_filetype or not bill_filetype.startswith('image/') or len(bill_document) < min_bytes:
+        return bill_document, bill_filename, bill_filetype
+    
+    try:
+        # Image.open only parses the header; skip the decode/re-encode when it can't pay off
+        img = Image.open(io.BytesIO(bill_document))
+        if img.format == 'JPEG' and max(img.size) <= max_size:
+            return bill_document, bill_filename, bill_filetype
+        icc_profile = img.info.get('icc_profile')
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+        if has_alpha:
+            # JPEG has no alpha channel: flatten onto white, or transparent areas come out black
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        output = io.BytesIO()
+        img.convert('RGB').save(output, format='JPEG', quality=80, optimize=True, progressive=True, icc_profile=icc_profile)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Unreadable image: keep the upload untouched
+        return bill_document, bill_filename, bill_filetype
+    
+    compressed = output.getvalue()
+    if len(compressed) >= len(bill_document):
+        return bill_document, bill_filename, bill_filetype
+    # Only rename once the JPEG has actually replaced the upload
+    return compressed, bill_filename.rsplit('.', 1)[0] + '.jpg', 'image/jpeg'
+
 def add_expense(date, brand, category, subcategory, amount, description, added_by, assigned_to=None, bill_document=None, bill_filename=None, bill_filetype=None, vendor_name=None, due_date=None):
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO expenses (date, brand, category, subcategory, amount, description, added_by, stage1_assigned_to, bill_document, bill_filename, bill_filetype, vendor_name, due_date)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (date, brand, category, subcategory, amount, description, added_by, assigned_to, bill_document, bill_filename, bill_filetype, vendor_name, due_date))
-    conn.commit()
-    conn.close()
+    if bill_document is not None:
+        bill_document, bill_filename, bill_filetype = compress_bill(bill_document, bill_filename, bill_filetype)
+    # Bind dates as the ISO text SQLite stores, not through sqlite3's (deprecated) per-value date adapter
+    date = date.isoformat()
+    due_date = due_date.isoformat() if due_date else None
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            c.execute('''
+                INSERT INTO expenses (date, brand, category, subcategory, amount, description, added_by, stage1_assigned_to, bill_filename, bill_filetype, vendor_name, due_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (date, brand, category, subcategory, amount, description, added_by, assigned_to, bill_filename, bill_filetype, vendor_name, due_date))
+            if bill_document is not None:
+                c.execute("INSERT INTO expense_bills (expense_id, bill_document) VALUES (?, ?)", (c.lastrowid, bill_document))
+    # New rows change get_db_version(), so the expense caches keyed on it miss on their own
 
+def add_expenses_bulk(rows):
+    """Insert many expenses (without bill documents) in a single transaction (one fsync for the whole batch)
+    
+    Each row is (date, brand, category, subcategory, amount, description, added_by, assigned_to, vendor_name, due_date).
+    """
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            c.executemany('''
+                INSERT INTO expenses (date, brand, category, subcategory, amount, description, added_by, stage1_assigned_to, vendor_name, due_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+
+@st.cache_data(ttl=300, show_spinner=False)
 def get_brand_heads():
     """Get all users with brand_heads role"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute("""
-        SELECT id, full_name, username 
-        FROM users 
-        WHERE role = 'brand_heads' AND is_active = 1
-        ORDER BY full_name
-    """)
-    result = c.fetchall()
-    conn.close()
-    return result
+    with read_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT id, full_name, username 
+            FROM users 
+            WHERE role = 'brand_heads' AND is_active = 1
+            ORDER BY full_name
+        """)
+        # Plain tuples so the result can be cached (sqlite3.Row doesn't pickle)
+        return [tuple(row) for row in c.fetchall()]
+
+def clear_user_caches():
+    """Drop cached user lists after a user is created, (de)activated or deleted"""
+    get_all_users.clear()
+    get_brand_heads.clear()
 
 def update_expense_bill(expense_id, bill_document, bill_filename, bill_filetype):
     """Update expense with bill document"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''
-        UPDATE expenses 
-        SET bill_document = ?, bill_filename = ?, bill_filetype = ?
-        WHERE id = ?
-    ''', (bill_document, bill_filename, bill_filetype, expense_id))
-    conn.commit()
-    conn.close()
+    bill_document, bill_filename, bill_filetype = compress_bill(bill_document, bill_filename, bill_filetype)
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            c.execute("INSERT OR REPLACE INTO expense_bills (expense_id, bill_document) VALUES (?, ?)", (expense_id, bill_document))
+            c.execute('''
+                UPDATE expenses 
+                SET bill_filename = ?, bill_filetype = ?
+                WHERE id = ?
+            ''', (bill_filename, bill_filetype, expense_id))
+    clear_expense_caches()
+    get_bill_document.clear()
+
+@st.cache_data(ttl=300, max_entries=50)
+def get_bill_document(expense_id):
+    """Get the bill document bytes for an expense"""
+    with read_conn() as conn:
+        # expense_id is the rowid of expense_bills, so the blob can be read directly (Python 3.11+)
+        if hasattr(conn, 'blobopen'):
+            try:
+                with conn.blobopen('expense_bills', 'bill_document', int(expense_id), readonly=True) as blob:
+                    return blob.read()
+            except sqlite3.OperationalError:
+                # No bill stored for this expense
+                return None
+        result = conn.execute("SELECT bill_document FROM expense_bills WHERE expense_id = ?", (expense_id,)).fetchone()
+        return result[0] if result else None
 
 def change_password(username, old_password, new_password):
     """Change user's own password"""
@@ -484,157 +720,320 @@ def change_password(username, old_password, new_password):
     old_hashed = hashlib.sha256(old_password.encode()).hexdigest()
     new_hashed = hashlib.sha256(new_password.encode()).hexdigest()
     
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    # Check old password 
-    c.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, old_hashed))
-    if not c.fetchone():
-        conn.close()
-        return False, "Current password is incorrect"
-    
-    # Update password
-    c.execute("UPDATE users SET password = ? WHERE username = ?", (new_hashed, username))
-    
-    # Invalidate all existing tokens for this user
-    c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
-    
-    conn.commit()
-    conn.close()
-    return True, "Password changed successfully"
-
-def get_all_expenses():
-    conn = sqlite3.connect('expenses.db')
-    df = pd.read_sql_query("SELECT * FROM expenses ORDER BY date DESC", conn)
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        
+        # Check old password 
+        c.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, old_hashed))
+        if not c.fetchone():
+            return False, "Current password is incorrect"
+        
+        c.execute("BEGIN")
+        with conn:
+            # Update password
+            c.execute("UPDATE users SET password = ? WHERE username = ?", (new_hashed, username))
+            
+            # Invalidate all existing tokens for this user
+            c.execute("UPDATE session_tokens SET is_valid = 0 WHERE username = ?", (username,))
+        
+        return True, "Password changed successfully"
+
+def get_db_version():
+    """Cheap fingerprint of the expenses table, used to key cached reads"""
+    with read_conn() as conn:
+        return tuple(conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM expenses").fetchone())
+
+# Expense cards rendered per page on the list pages
+PAGE_SIZE = 20
+
+# Low-cardinality text columns stored as pandas categoricals to keep cached frames small
+CATEGORICAL_COLUMNS = [
+    'brand', 'category', 'subcategory', 'added_by', 'stage1_assigned_to', 'bill_filetype',
+    'stage1_status', 'stage1_approved_by', 'stage2_status', 'stage2_approved_by',
+    'stage3_status', 'stage3_paid_by', 'stage3_payment_mode'
+]
+
+def shrink_dtypes(df):
+    """Convert repeated text columns to category dtype (amount stays float64 so totals are exact to the paisa)"""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
     return df
 
-def get_expenses_for_approval(stage, username=None):
+def build_expense_filters(brands=None, categories=None, subcategories=None, statuses=None, date_from=None, date_to=None, assigned_to=None):
+    """Build a parameterized WHERE clause for the expense filters"""
+    conditions = []
+    params = []
+    
+    if brands:
+        conditions.append(f"brand IN ({', '.join('?' * len(brands))})")
+        params.extend(brands)
+    if categories:
+        conditions.append(f"category IN ({', '.join('?' * len(categories))})")
+        params.extend(categories)
+    if subcategories:
+        conditions.append(f"subcategory IN ({', '.join('?' * len(subcategories))})")
+        params.extend(subcategories)
+    if statuses:
+        conditions.append("(" + " OR ".join(f"({STATUS_FILTERS[s]})" for s in statuses) + ")")
+    if date_from:
+        conditions.append("date >= ?")
+        params.append(date_from.isoformat())
+    if date_to:
+        conditions.append("date <= ?")
+        params.append(date_to.isoformat())
+    if assigned_to:
+        conditions.append("stage1_assigned_to = ?")
+        params.append(assigned_to)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+def read_expenses(brands=None, categories=None, subcategories=None, statuses=None, date_from=None, date_to=None, assigned_to=None, limit=None, offset=0):
+    """Read expenses matching the given filters straight from SQL (uncached)"""
+    where, params = build_expense_filters(brands, categories, subcategories, statuses, date_from, date_to, assigned_to)
+    query = f"SELECT {EXPENSE_COLUMNS} FROM expenses {where} ORDER BY date DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params = [*params, limit, offset]
+    with read_conn() as conn:
+        if limit is None:
+            # Unpaged reads (exports) can be large: fetch in chunks instead of one fetchall
+            df = pd.concat(pd.read_sql_query(query, conn, params=params, chunksize=5000), ignore_index=True)
+        else:
+            df = pd.read_sql_query(query, conn, params=params)
+    # Parse the ISO date strings once here so pages can compare dates directly
+    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d').dt.date
+    return shrink_dtypes(df)
+
+@st.cache_data(ttl=60, max_entries=100, show_spinner=False)
+def get_expenses(db_version, brands=None, categories=None, subcategories=None, statuses=None, date_from=None, date_to=None, assigned_to=None, limit=None, offset=0):
+    """Get expenses matching the given filters (filtering is done in SQL, cached until the table changes)"""
+    return read_expenses(brands, categories, subcategories, statuses, date_from, date_to, assigned_to, limit, offset)
+
+@st.cache_data(ttl=60, max_entries=100, show_spinner=False)
+def get_expense_metrics(db_version, brands=None, categories=None, subcategories=None, statuses=None, date_from=None, date_to=None, assigned_to=None):
+    """Get total amount, count, paid/pending counts and bill count for the given filters in one query"""
+    where, params = build_expense_filters(brands, categories, subcategories, statuses, date_from, date_to, assigned_to)
+    with read_conn() as conn:
+        return read_expense_metrics(conn, where, params)
+
+def read_expense_metrics(conn, where, params):
+    """Run the metrics query for a WHERE clause from build_expense_filters on an already borrowed connection"""
+    total, count, paid, pending, with_bills = conn.execute(f"""
+        SELECT COALESCE(SUM(amount), 0), COUNT(*),
+               COALESCE(SUM(stage3_status = 'Paid'), 0), COALESCE(SUM(stage3_status = 'Pending'), 0),
+               COUNT(bill_filename)
+        FROM expenses {where}
+    """, params).fetchone()
+    return {'total': total, 'count': count, 'paid': paid, 'pending': pending, 'with_bills': with_bills}
+
+# Columns the Dashboard shows totals by
+SUMMARY_COLUMNS = ('brand', 'category')
+
+@st.cache_data(ttl=60, max_entries=100, show_spinner=False)
+def get_dashboard_summary(db_version, brands=None, categories=None, subcategories=None, statuses=None, date_from=None, date_to=None, assigned_to=None, limit=10):
+    """Get the metrics and the top total amounts per SUMMARY_COLUMNS entry for the given filters (one connection, one cache entry)"""
+    where, params = build_expense_filters(brands, categories, subcategories, statuses, date_from, date_to, assigned_to)
+    # The filtered rows are read once and grouped by each summary column in turn
+    branches = " UNION ALL ".join(f"""
+        SELECT '{column}' AS grouped_by, label, amount FROM (
+            SELECT {column} AS label, SUM(amount) AS amount FROM filtered
+            GROUP BY {column} ORDER BY amount DESC LIMIT ?
+        )""" for column in SUMMARY_COLUMNS)
+    with read_conn() as conn:
+        metrics = read_expense_metrics(conn, where, params)
+        totals = pd.read_sql_query(f"""
+            WITH filtered AS (SELECT {', '.join(SUMMARY_COLUMNS)}, amount FROM expenses {where})
+            {branches}
+        """, conn, params=[*params, *[limit] * len(SUMMARY_COLUMNS)])
+    return metrics, {
+        column: group.drop(columns='grouped_by').rename(columns={'label': column}).reset_index(drop=True)
+        for column, group in totals.groupby('grouped_by', sort=False)
+    }
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_expense_filter_options(db_version, assigned_to=None):
+    """Get the ready-made filter widget option lists and the date span"""
+    where, params = ("WHERE stage1_assigned_to = ?", (assigned_to,)) if assigned_to else ("", ())
+    with read_conn() as conn:
+        rows = conn.execute(f"SELECT DISTINCT brand, category, subcategory FROM expenses {where}", params).fetchall()
+        date_span = tuple(conn.execute(f"SELECT MIN(date), MAX(date) FROM expenses {where}", params).fetchone())
+    
+    if not rows:
+        return {}, date_span
+    
+    # Widgets only look lists up here, so build them once per table version
+    subcategories = {}
+    for _, category, subcategory in rows:
+        if subcategory:
+            subcategories.setdefault(category, set()).add(subcategory)
+    options = {
+        'brands': ["All"] + sorted({brand for brand, _, _ in rows}),
+        'categories': ["All"] + sorted({category for _, category, _ in rows}),
+        'subcategories': {category: ["All"] + sorted(subs) for category, subs in subcategories.items()},
+        'all_subcategories': ["All"] + sorted(set().union(*subcategories.values())),
+    }
+    return options, date_span
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_expenses_for_approval(db_version, stage, username=None):
     """Get expenses pending at specific approval stage"""
-    conn = sqlite3.connect('expenses.db')
-    if stage == 1:
+    if stage == 1 and username:
         # Brand heads only see expenses assigned to them
-        if username:
-            query = """
-                SELECT * FROM expenses 
-                WHERE stage1_status = 'Pending' AND stage1_assigned_to = ?
-                ORDER BY created_at ASC
-            """
-            df = pd.read_sql_query(query, conn, params=(username,))
-        else:
-            query = """
-                SELECT * FROM expenses 
-                WHERE stage1_status = 'Pending' 
-                ORDER BY created_at ASC
-            """
-            df = pd.read_sql_query(query, conn)
-    elif stage == 2:
-        query = """
-            SELECT * FROM expenses 
-            WHERE stage1_status = 'Approved' AND stage2_status = 'Pending' 
-            ORDER BY created_at ASC
-        """
-        df = pd.read_sql_query(query, conn)
-    elif stage == 3:
-        query = """
-            SELECT * FROM expenses 
-            WHERE stage1_status = 'Approved' AND stage2_status = 'Approved' 
-            AND stage3_status = 'Pending' 
-            ORDER BY created_at ASC
-        """
-        df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+        query, params = PENDING_ASSIGNED_QUERY, (username,)
+    else:
+        query, params = PENDING_QUERIES[stage], ()
+    with read_conn() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    return shrink_dtypes(df)
 
-def get_approved_expenses_by_user(username, stage):
-    """Get all expenses approved/rejected by a specific user at a given stage"""
-    conn = sqlite3.connect('expenses.db')
-    if stage == 1:
-        query = """
-            SELECT * FROM expenses 
-            WHERE stage1_approved_by = ? AND stage1_status IN ('Approved', 'Rejected')
-            ORDER BY stage1_approved_date DESC
-        """
-    elif stage == 2:
-        query = """
-            SELECT * FROM expenses 
-            WHERE stage2_approved_by = ? AND stage2_status IN ('Approved', 'Rejected')
-            ORDER BY stage2_approved_date DESC
-        """
-    elif stage == 3:
-        query = """
-            SELECT * FROM expenses 
-            WHERE stage3_paid_by = ? AND stage3_status IN ('Paid', 'Rejected')
-            ORDER BY stage3_paid_date DESC
-        """
-    df = pd.read_sql_query(query, conn, params=(username,))
-    conn.close()
-    return df
+# Reviewer, decision and decision-date columns behind each stage's history tab, and its positive decision
+HISTORY_COLUMNS = {
+    1: ('stage1_approved_by', 'stage1_status', 'stage1_approved_date', 'Approved'),
+    2: ('stage2_approved_by', 'stage2_status', 'stage2_approved_date', 'Approved'),
+    3: ('stage3_paid_by', 'stage3_status', 'stage3_paid_date', 'Paid')
+}
 
-def get_expenses_by_user(username):
-    """Get all expenses added by a specific user"""
-    conn = sqlite3.connect('expenses.db')
-    query = """
-        SELECT * FROM expenses 
+@st.cache_data(ttl=60, show_spinner=False)
+def get_approved_expenses_by_user(db_version, username, stage, limit=None, offset=0):
+    """Get the expenses approved/rejected by a specific user at a given stage, optionally one page at a time"""
+    reviewer, status, decided_on, accepted = HISTORY_COLUMNS[stage]
+    query = f"""
+        SELECT {EXPENSE_COLUMNS} FROM expenses 
+        WHERE {reviewer} = ? AND {status} IN (?, 'Rejected')
+        ORDER BY {decided_on} DESC, id DESC
+    """
+    params = (username, accepted)
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params += (limit, offset)
+    with read_conn() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    return shrink_dtypes(df)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_approval_history_summary(db_version, username, stage):
+    """Get the reviewed count, approved/paid and rejected counts and approved/paid amount for a history tab in one query"""
+    reviewer, status, _, accepted = HISTORY_COLUMNS[stage]
+    with read_conn() as conn:
+        count, accepted_count, rejected, accepted_amount = conn.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM({status} = ?), 0), COALESCE(SUM({status} = 'Rejected'), 0),
+                   COALESCE(SUM(CASE WHEN {status} = ? THEN amount END), 0)
+            FROM expenses
+            WHERE {reviewer} = ? AND {status} IN (?, 'Rejected')
+        """, (accepted, accepted, username, accepted)).fetchone()
+        return {'count': count, 'accepted': accepted_count, 'rejected': rejected, 'accepted_amount': accepted_amount}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_expenses_by_user(db_version, username, limit=None, offset=0):
+    """Get the expenses added by a specific user, optionally one page at a time"""
+    query = f"""
+        SELECT {EXPENSE_COLUMNS} FROM expenses 
         WHERE added_by = ? 
-        ORDER BY created_at DESC
+        ORDER BY created_at DESC, id DESC
     """
-    df = pd.read_sql_query(query, conn, params=(username,))
-    conn.close()
-    return df
+    params = (username,)
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params += (limit, offset)
+    with read_conn() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    return shrink_dtypes(df)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_user_expense_summary(db_version, username):
+    """Get total amount, count and stage 1 pending / paid counts of a user's own expenses in one query"""
+    with read_conn() as conn:
+        total, count, pending, paid = conn.execute("""
+            SELECT COALESCE(SUM(amount), 0), COUNT(*),
+                   COALESCE(SUM(stage1_status = 'Pending'), 0), COALESCE(SUM(stage3_status = 'Paid'), 0)
+            FROM expenses
+            WHERE added_by = ?
+        """, (username,)).fetchone()
+        return {'total': total, 'count': count, 'pending': pending, 'paid': paid}
+
+def clear_expense_caches():
+    """Drop cached expense reads after an UPDATE (updates don't change get_db_version(), inserts do)"""
+    for cached in (get_expenses, get_expense_metrics, get_dashboard_summary, get_expense_filter_options,
+                   get_expenses_for_approval, get_approved_expenses_by_user, get_approval_history_summary,
+                   get_expenses_by_user, get_user_expense_summary, export_expenses):
+        cached.clear()
 
 def approve_expense_stage1(expense_id, approved_by, status, remarks):
     """Approve/Reject at Stage 1"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''
-        UPDATE expenses 
-        SET stage1_status = ?, stage1_approved_by = ?, 
-            stage1_approved_date = ?, stage1_remarks = ?
-        WHERE id = ?
-    ''', (status, approved_by, datetime.now(), remarks, expense_id))
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute('''
+            UPDATE expenses 
+            SET stage1_status = ?, stage1_approved_by = ?, 
+                stage1_approved_date = datetime('now', 'localtime'), stage1_remarks = ?
+            WHERE id = ?
+        ''', (status, approved_by, remarks, expense_id))
+        conn.commit()
+    clear_expense_caches()
 
 def approve_expense_stage2(expense_id, approved_by, status, remarks):
     """Approve/Reject at Stage 2"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''
-        UPDATE expenses 
-        SET stage2_status = ?, stage2_approved_by = ?, 
-            stage2_approved_date = ?, stage2_remarks = ?
-        WHERE id = ?
-    ''', (status, approved_by, datetime.now(), remarks, expense_id))
-    conn.commit()
-    conn.close()
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute('''
+            UPDATE expenses 
+            SET stage2_status = ?, stage2_approved_by = ?, 
+                stage2_approved_date = datetime('now', 'localtime'), stage2_remarks = ?
+            WHERE id = ?
+        ''', (status, approved_by, remarks, expense_id))
+        conn.commit()
+    clear_expense_caches()
 
 def approve_expense_stage3(expense_id, paid_by, status, payment_mode, transaction_ref, remarks):
     """Mark as Paid at Stage 3"""
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''
-        UPDATE expenses 
-        SET stage3_status = ?, stage3_paid_by = ?, 
-            stage3_paid_date = ?, stage3_payment_mode = ?,
-            stage3_transaction_ref = ?, stage3_remarks = ?
-        WHERE id = ?
-    ''', (status, paid_by, datetime.now(), payment_mode, transaction_ref, remarks, expense_id))
-    conn.commit()
-    conn.close()
-
-def get_overall_status(row):
-    """Determine overall status of expense"""
-    if row['stage3_status'] == 'Paid':
-        return '✅ Paid'
-    elif row['stage3_status'] == 'Rejected' or row['stage2_status'] == 'Rejected' or row['stage1_status'] == 'Rejected':
-        return '❌ Rejected'
-    elif row['stage2_status'] == 'Approved':
-        return '⏳ Payment Pending'
-    elif row['stage1_status'] == 'Approved':
-        return '⏳ Stage 2 Approval Pending'
-    else:
-        return '⏳ Stage 1 Approval Pending'
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute('''
+            UPDATE expenses 
+            SET stage3_status = ?, stage3_paid_by = ?, 
+                stage3_paid_date = datetime('now', 'localtime'), stage3_payment_mode = ?,
+                stage3_transaction_ref = ?, stage3_remarks = ?
+            WHERE id = ?
+        ''', (status, paid_by, payment_mode, transaction_ref, remarks, expense_id))
+        conn.commit()
+    clear_expense_caches()
+
+def approve_expenses_bulk(stage, expense_ids, approved_by, remarks):
+    """Approve several expenses still pending at Stage 1 or 2 in a single transaction"""
+    reviewer, status, decided_on, _ = HISTORY_COLUMNS[stage]
+    conn = get_write_conn()
+    with get_write_lock():
+        c = conn.cursor()
+        c.execute("BEGIN")
+        with conn:
+            c.executemany(f'''
+                UPDATE expenses 
+                SET {status} = 'Approved', {reviewer} = ?, 
+                    {decided_on} = datetime('now', 'localtime'), stage{stage}_remarks = ?
+                WHERE id = ? AND {status} = 'Pending'
+            ''', [(approved_by, remarks, int(expense_id)) for expense_id in expense_ids])
+    clear_expense_caches()
+
+# Overall status labels, in the order get_overall_status checks them (the last one is the fallback)
+OVERALL_STATUSES = ['✅ Paid', '❌ Rejected', '⏳ Payment Pending', '⏳ Stage 2 Approval Pending', '⏳ Stage 1 Approval Pending']
+
+def get_overall_status(df):
+    """Determine overall status of each expense (vectorized over the whole frame)"""
+    conditions = [
+        df['stage3_status'] == 'Paid',
+        (df['stage3_status'] == 'Rejected') | (df['stage2_status'] == 'Rejected') | (df['stage1_status'] == 'Rejected'),
+        df['stage2_status'] == 'Approved',
+        df['stage1_status'] == 'Approved'
+    ]
+    # Pick small integer codes and wrap them as a categorical instead of filling an array of label strings
+    codes = np.select(conditions, range(len(conditions)), default=len(conditions))
+    return pd.Categorical.from_codes(codes, categories=OVERALL_STATUSES)
 
 def get_stage_status_display(row):
     """Get formatted status display for all stages"""
@@ -664,18 +1063,329 @@ def get_stage_status_display(row):
     
     return f"{s1} | {s2} | {s3}"
 
-def get_category_display(row):
-    """Format category and subcategory for display"""
-    if pd.notna(row.get('subcategory')) and row['subcategory']:
-        return f"{row['category']} - {row['subcategory']}"
-    return row['category']
+def get_category_display(df):
+    """Format category and subcategory for display (vectorized over the whole frame)"""
+    category = df['category'].astype(object)
+    subcategory = df['subcategory'].astype(object)
+    has_subcategory = subcategory.notna() & (subcategory != '')
+    return category.where(~has_subcategory, category + ' - ' + subcategory)
 
 def to_excel(df):
+    """Stream the DataFrame into an .xlsx workbook row by row (constant memory)"""
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Data')
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+    worksheet = workbook.add_worksheet('Data')
+    worksheet.write_row(0, 0, df.columns.tolist())
+    
+    # constant_memory flushes a row as soon as the next one starts, so write row by row
+    # (pandas' to_excel writes column by column, which this mode cannot handle)
+    values = df.astype(object).where(df.notna(), None)
+    for row_num, row in enumerate(values.itertuples(index=False), start=1):
+        worksheet.write_row(row_num, 0, row)
+    
+    workbook.close()
     return output.getvalue()
 
+@st.cache_data(ttl=60, max_entries=20)
+def export_expenses(db_version, file_format, brands=None, categories=None, subcategories=None, statuses=None, date_from=None, date_to=None, assigned_to=None):
+    """Build the CSV or Excel download for the given filters (cached per filter set and table version)"""
+    # Read directly so the unpaged rows aren't also kept in get_expenses' cache
+    df = read_expenses(brands, categories, subcategories, statuses, date_from, date_to, assigned_to)
+    if not df.empty:
+        df['Overall_Status'] = get_overall_status(df)
+        df['Category_Display'] = get_category_display(df)
+    if file_format == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+    return to_excel(df)
+
+@st.cache_data(ttl=60, max_entries=100, show_spinner=False)
+def build_dashboard_charts(brand_summary, category_summary):
+    """Build the Dashboard charts as Plotly JSON (the frames are top-10 aggregates, so hashing them is cheap)"""
+    brand_fig = px.bar(brand_summary, x='brand', y='amount', 
+                       title='Top 10 Brands by Expense',
+                       labels={'amount': 'Amount (₹)', 'brand': 'Brand'})
+    category_fig = px.pie(category_summary, values='amount', names='category',
+                          title='Expense Distribution by Category')
+    return pio.to_json(brand_fig), pio.to_json(category_fig)
+
+def flash_toast(message, icon):
+    """Queue a toast for the next run, so handlers can st.rerun() straight away instead of sleeping"""
+    st.session_state.setdefault('flash_toasts', []).append((message, icon))
+
+def page_offset(total, key, page_size=PAGE_SIZE):
+    """Return the row offset of the chosen page, showing a page picker when total rows span more than one page"""
+    total_pages = (total - 1) // page_size + 1
+    if total_pages <= 1:
+        return 0
+    # The list may have shrunk since the page was picked
+    if st.session_state.get(key, 1) > total_pages:
+        st.session_state[key] = total_pages
+    page_num = st.number_input(f"Page (of {total_pages})", min_value=1, max_value=total_pages, step=1, key=key)
+    return (page_num - 1) * page_size
+
+def paginate(df, key, page_size=PAGE_SIZE):
+    """Return one page of df, showing a page picker when it spans more than one page"""
+    if len(df) <= page_size:
+        return df
+    offset = page_offset(len(df), key, page_size)
+    return df.iloc[offset:offset + page_size].copy()
+
+def render_bill_download(row, key, label="📥 View Bill"):
+    """Bill download button whose bytes are only read and sent once the user asks for them"""
+    loaded = st.session_state.setdefault('loaded_bills', set())
+    expense_id = int(row['id'])
+    if expense_id not in loaded:
+        if not st.button("📎 Load Bill", key=f"load_{key}"):
+            return False
+        loaded.add(expense_id)
+    return st.download_button(
+        label=label,
+        data=get_bill_document(expense_id),
+        file_name=row['bill_filename'],
+        mime=row['bill_filetype'],
+        key=key
+    )
+
+def render_bulk_approval(stage, page_expenses):
+    """Form approving any of the listed pending expenses at once (one transaction for the batch)"""
+    labels = {
+        row['id']: f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f}"
+        for row in page_expenses[['id', 'brand', 'Category_Display', 'amount']].to_dict('records')
+    }
+    with st.expander("⚡ Approve several at once"):
+        with st.form(f"s{stage}_bulk_approve", clear_on_submit=True, border=False):
+            selected = st.multiselect("Expenses to approve", list(labels), format_func=labels.get)
+            remarks = st.text_area("💬 Remarks (applied to each)")
+            if st.form_submit_button("✅ Approve Selected", type="primary"):
+                if selected:
+                    approve_expenses_bulk(stage, selected, st.session_state.full_name, remarks)
+                    flash_toast(f"✅ {len(selected)} expense(s) have been approved successfully!", icon="✅")
+                    st.rerun()
+                else:
+                    st.warning("⚠️ Please select at least one expense")
+
+@st.fragment
+def render_stage1_pending_row(row):
+    """Render one Stage 1 approval card (widget interactions rerun only this card)"""
+    status_display = get_stage_status_display(row)
+    
+    with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("💰 Amount", f"₹{row['amount']:,.2f}")
+        col2.metric("🏢 Brand", row['brand'])
+        col3.metric("📂 Category", row['Category_Display'])
+        
+        st.markdown(f"**📝 Description:** {row['description']}")
+        if pd.notna(row.get('vendor_name')) and row['vendor_name']:
+            st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
+        if pd.notna(row.get('due_date')) and row['due_date']:
+            st.markdown(f"**📆 Due Date:** {row['due_date']}")
+        st.markdown(f"**👤 Submitted By:** {row['added_by']}")
+        if pd.notna(row.get('stage1_assigned_to')):
+            st.markdown(f"**👨‍💼 Assigned To:** {row['stage1_assigned_to']}")
+        st.markdown(f"**📅 Submitted On:** {row['created_at']}")
+        
+        # Show bill if available
+        if pd.notna(row.get('bill_filename')):
+            st.markdown("---")
+            st.markdown("### 📎 Attached Bill/Document")
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.success(f"✅ **{row['bill_filename']}**")
+            with col2:
+                render_bill_download(row, f"s1_view_bill_{row['id']}")
+        else:
+            st.info("ℹ️ No bill attached")
+        
+        st.markdown("---")
+        # Remarks are only sent with the decision, so typing them doesn't rerun anything
+        with st.form(f"s1_decision_{row['id']}", border=False):
+            remarks = st.text_area("💬 Remarks", key=f"remarks_s1_{row['id']}")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.form_submit_button("✅ Approve", type="primary", use_container_width=True):
+                    approve_expense_stage1(row['id'], st.session_state.full_name, 'Approved', remarks)
+                    flash_toast("✅ Expense has been approved successfully!", icon="✅")
+                    st.rerun()
+            
+            with col2:
+                if st.form_submit_button("❌ Reject", use_container_width=True):
+                    if remarks:
+                        approve_expense_stage1(row['id'], st.session_state.full_name, 'Rejected', remarks)
+                        flash_toast("❌ Expense has been rejected successfully!", icon="❌")
+                        st.rerun()
+                    else:
+                        st.warning("⚠️ Please provide remarks for rejection")
+
+@st.fragment
+def render_stage2_pending_row(row):
+    """Render one Stage 2 approval card (widget interactions rerun only this card)"""
+    status_display = get_stage_status_display(row)
+    
+    with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("💰 Amount", f"₹{row['amount']:,.2f}")
+        col2.metric("🏢 Brand", row['brand'])
+        col3.metric("📂 Category", row['Category_Display'])
+        
+        st.markdown(f"**📝 Description:** {row['description']}")
+        if pd.notna(row.get('vendor_name')) and row['vendor_name']:
+            st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
+        if pd.notna(row.get('due_date')) and row['due_date']:
+            st.markdown(f"**📆 Due Date:** {row['due_date']}")
+        st.markdown(f"**👤 Submitted By:** {row['added_by']}")
+        st.markdown(f"**📅 Expense Date:** {row['date']}")
+        
+        # Show bill if available
+        if pd.notna(row.get('bill_filename')):
+            st.markdown("---")
+            st.markdown("### 📎 Attached Bill/Document")
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.success(f"✅ **{row['bill_filename']}**")
+            with col2:
+                render_bill_download(row, f"s2_view_bill_{row['id']}")
+        else:
+            st.info("ℹ️ No bill attached")
+        
+        st.markdown("---")
+        st.markdown("**Stage 1 Approval:**")
+        st.markdown(f"- ✅ Approved by: {row['stage1_approved_by']}")
+        st.markdown(f"- 📅 Approved on: {row['stage1_approved_date']}")
+        if pd.notna(row.get('stage1_remarks')) and row['stage1_remarks']:
+            st.markdown(f"- 💬 Remarks: {row['stage1_remarks']}")
+        
+        st.markdown("---")
+        with st.form(f"s2_decision_{row['id']}", border=False):
+            remarks = st.text_area("💬 Remarks", key=f"remarks_s2_{row['id']}")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.form_submit_button("✅ Approve", type="primary", use_container_width=True):
+                    approve_expense_stage2(row['id'], st.session_state.full_name, 'Approved', remarks)
+                    flash_toast("✅ Expense has been approved successfully!", icon="✅")
+                    st.rerun()
+            
+            with col2:
+                if st.form_submit_button("❌ Reject", use_container_width=True):
+                    if remarks:
+                        approve_expense_stage2(row['id'], st.session_state.full_name, 'Rejected', remarks)
+                        flash_toast("❌ Expense has been rejected successfully!", icon="❌")
+                        st.rerun()
+                    else:
+                        st.warning("⚠️ Please provide remarks for rejection")
+
+@st.fragment
+def render_stage3_pending_row(row):
+    """Render one payment card (widget interactions rerun only this card)"""
+    status_display = get_stage_status_display(row)
+    
+    with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("💰 Amount to Pay", f"₹{row['amount']:,.2f}")
+        col2.metric("🏢 Brand", row['brand'])
+        col3.metric("📂 Category", row['Category_Display'])
+        
+        st.markdown(f"**📝 Description:** {row['description']}")
+        if pd.notna(row.get('vendor_name')) and row['vendor_name']:
+            st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
+        if pd.notna(row.get('due_date')) and row['due_date']:
+            st.markdown(f"**📆 Due Date:** {row['due_date']}")
+        st.markdown(f"**👤 Submitted By:** {row['added_by']}")
+        st.markdown(f"**📅 Expense Date:** {row['date']}")
+        
+        # Show bill if available
+        if pd.notna(row.get('bill_filename')):
+            st.markdown("---")
+            st.markdown("### 📎 Attached Bill/Document")
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.success(f"✅ **{row['bill_filename']}**")
+            with col2:
+                render_bill_download(row, f"s3_view_bill_{row['id']}")
+        else:
+            st.info("ℹ️ No bill attached")
+        
+        st.markdown("---")
+        st.markdown("**✅ Approval Status:**")
+        st.markdown(f"- Stage 1: ✅ Approved by {row['stage1_approved_by']} on {row['stage1_approved_date']}")
+        st.markdown(f"- Stage 2: ✅ Approved by {row['stage2_approved_by']} on {row['stage2_approved_date']}")
+        
+        st.markdown("---")
+        with st.form(f"s3_payment_{row['id']}", border=False):
+            col1, col2 = st.columns(2)
+            with col1:
+                payment_mode = st.selectbox("💳 Payment Mode", PAYMENT_MODES, key=f"pm_{row['id']}")
+                transaction_ref = st.text_input("🔢 Transaction Reference/Cheque No.", key=f"tr_{row['id']}")
+            
+            with col2:
+                remarks = st.text_area("💬 Payment Remarks", key=f"remarks_s3_{row['id']}")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.form_submit_button("💰 Mark as Paid", type="primary", use_container_width=True):
+                    if transaction_ref:
+                        approve_expense_stage3(row['id'], st.session_state.full_name, 'Paid', 
+                                               payment_mode, transaction_ref, remarks)
+                        flash_toast("✅ Expense has been paid successfully!", icon="✅")
+                        st.rerun()
+                    else:
+                        st.warning("⚠️ Please provide transaction reference")
+            
+            with col2:
+                if st.form_submit_button("❌ Reject Payment", use_container_width=True):
+                    if remarks:
+                        approve_expense_stage3(row['id'], st.session_state.full_name, 'Rejected', 
+                                               None, None, remarks)
+                        flash_toast("❌ Payment has been rejected successfully!", icon="❌")
+                        st.rerun()
+                    else:
+                        st.warning("⚠️ Please provide remarks for rejection")
+
+# Columns accepted by the bulk CSV upload (the first five are required)
+BULK_UPLOAD_COLUMNS = ['date', 'brand', 'category', 'amount', 'assigned_to', 'subcategory', 'description', 'vendor_name', 'due_date']
+
+def parse_expense_csv(csv_file, added_by, brand_head_names):
+    """Validate an uploaded expenses CSV and return (rows for add_expenses_bulk, error messages)"""
+    try:
+        df = pd.read_csv(io.BytesIO(csv_file.getvalue()), dtype=str, keep_default_na=False)
+    except (pd.errors.EmptyDataError, pd.errors.ParserError, UnicodeDecodeError):
+        return [], ["Could not read the file as a UTF-8 CSV"]
+    df.columns = df.columns.str.strip().str.lower()
+    missing = [col for col in BULK_UPLOAD_COLUMNS[:5] if col not in df.columns]
+    if missing:
+        return [], [f"Missing column(s): {', '.join(missing)}"]
+    df = df.reindex(columns=BULK_UPLOAD_COLUMNS, fill_value='').apply(lambda col: col.str.strip())
+    
+    dates = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce')
+    due_dates = pd.to_datetime(df['due_date'], format='%Y-%m-%d', errors='coerce')
+    amounts = pd.to_numeric(df['amount'], errors='coerce')
+    bad_subcategory = [sub != '' and sub not in SUBCATEGORY_SETS.get(cat, ()) for cat, sub in zip(df['category'], df['subcategory'])]
+    checks = {
+        "date must be YYYY-MM-DD": dates.isna(),
+        "unknown brand": ~df['brand'].isin(BRAND_SET),
+        "unknown category": ~df['category'].isin(SUBCATEGORY_SETS.keys()),
+        "subcategory doesn't belong to the category": pd.Series(bad_subcategory, index=df.index, dtype=bool),
+        "amount must be a positive number": ~(amounts > 0),
+        "assigned_to must be an active Brand Head": ~df['assigned_to'].isin(brand_head_names),
+        "due_date must be YYYY-MM-DD": due_dates.isna() & (df['due_date'] != '')
+    }
+    # Report spreadsheet row numbers (header is row 1)
+    errors = [f"Row {i + 2}: {label}" for label, mask in checks.items() for i in df.index[mask]]
+    if errors:
+        return [], errors
+    
+    # Plain Python values in add_expenses_bulk's column order (blank optional fields become NULL)
+    blank_to_none = lambda col: col.where(col != '', None).tolist()
+    rows = list(zip(
+        dates.dt.strftime('%Y-%m-%d').tolist(), df['brand'].tolist(), df['category'].tolist(),
+        blank_to_none(df['subcategory']), amounts.astype(float).tolist(), df['description'].tolist(),
+        [added_by] * len(df), df['assigned_to'].tolist(), blank_to_none(df['vendor_name']),
+        blank_to_none(due_dates.dt.strftime('%Y-%m-%d').fillna(''))
+    ))
+    return rows, []
+
 # Clean up expired tokens on startup
 cleanup_expired_tokens()
 
@@ -700,6 +1410,10 @@ if not st.session_state.logged_in:
             st.session_state.auth_token = saved_token
             st.rerun()
 
+# Show toasts queued before the last st.rerun()
+for message, icon in st.session_state.pop('flash_toasts', []):
+    st.toast(message, icon=icon)
+
 # Login Page
 if not st.session_state.logged_in:
     st.title("🔐 Brand Expense Tracker")
@@ -719,20 +1433,19 @@ if not st.session_state.logged_in:
                 user_data = authenticate_user(username, password)
                 if user_data:
                     # Create session token
-                    token = create_session_token(user_data[0], remember_me)
+                    token = create_session_token(user_data['username'], remember_me)
                     
                     # Set session state
                     st.session_state.logged_in = True
-                    st.session_state.username = user_data[0]
-                    st.session_state.full_name = user_data[1]
-                    st.session_state.user_role = user_data[2]
+                    st.session_state.username = user_data['username']
+                    st.session_state.full_name = user_data['full_name']
+                    st.session_state.user_role = user_data['role']
                     st.session_state.auth_token = token
                     
                     # Save token to URL
                     save_token_to_url(token)
                     
-                    st.success(f"✅ Welcome {user_data[1]}!")
-                    time.sleep(0.5)
+                    flash_toast(f"✅ Welcome {user_data['full_name']}!", icon="✅")
                     st.rerun()
                 else:
                     st.error("❌ Invalid username or password!")
@@ -769,30 +1482,7 @@ with col2:
 st.markdown("---")
 
 # Navigation
-page_options = ["➕ Add Expense"]
-
-if st.session_state.user_role == "hr":
-    page_options.extend(["📝 My Expenses", "🔐 Change Password"])
-else:
-    if st.session_state.user_role in ["brand_heads", "admin"]:
-        page_options.append("✅ Approval Stage 1 (Brand Head)")
-    
-    if st.session_state.user_role in ["stage2_approver", "admin"]:
-        page_options.append("✅ Approval Stage 2 (Senior Manager)")
-    
-    if st.session_state.user_role in ["accounts_team", "admin"]:
-        page_options.append("💳 Approval Stage 3 (Accounts Payment)")
-    
-    # Dashboard only for stage2_approver, accounts_team, and admin
-    if st.session_state.user_role in ["stage2_approver", "accounts_team", "admin"]:
-        page_options.append("📊 Dashboard")
-    
-    page_options.extend(["📋 View All Expenses", "🔐 Change Password"])
-
-if st.session_state.user_role == "admin":
-    page_options.append("👥 User Management")
-
-page = st.sidebar.selectbox("📌 Navigation", page_options)
+page = st.sidebar.selectbox("📌 Navigation", ROLE_PAGES[st.session_state.user_role])
 
 # Clean page name
 page_clean = page.split(" ", 1)[1] if " " in page else page
@@ -835,8 +1525,8 @@ if page_clean == "Add Expense":
         # Get brand heads for assignment
         brand_heads = get_brand_heads()
         if brand_heads:
-            brand_head_options = {bh[1]: bh[1] for bh in brand_heads}
-            assigned_to = st.selectbox("👨‍💼 Assign to Brand Head *", options=list(brand_head_options.keys()))
+            brand_head_options = [bh[1] for bh in brand_heads]
+            assigned_to = st.selectbox("👨‍💼 Assign to Brand Head *", options=brand_head_options)
         else:
             st.warning("⚠️ No Brand Heads available. Please contact admin.")
             assigned_to = None
@@ -856,37 +1546,65 @@ if page_clean == "Add Expense":
                 bill_filetype = None
                 
                 if uploaded_file is not None:
-                    bill_document = uploaded_file.read()
+                    bill_document = uploaded_file.getvalue()
                     bill_filename = uploaded_file.name
                     bill_filetype = uploaded_file.type
                 
                 add_expense(expense_date, brand, category, subcategory, amount, description, added_by, assigned_to, bill_document, bill_filename, bill_filetype, vendor_name, due_date)
-                st.toast("✅ Expense has been added successfully!", icon="✅")
-                time.sleep(1)
+                flash_toast("✅ Expense has been added successfully!", icon="✅")
                 st.rerun()
             else:
                 st.error("⚠️ Please fill all required fields!")
+    
+    # Bulk import: one transaction for the whole file
+    st.markdown("---")
+    with st.expander("📤 Bulk Upload Expenses (CSV)"):
+        st.caption("Columns: date, brand, category, amount, assigned_to (required) and subcategory, description, vendor_name, due_date (optional). "
+                   "Dates as YYYY-MM-DD; assigned_to is a Brand Head's full name.")
+        upload_key = st.session_state.get('bulk_upload_key', 0)
+        csv_file = st.file_uploader("Upload CSV", type=['csv'], key=f"bulk_expense_csv_{upload_key}")
+        
+        if csv_file is not None:
+            brand_head_names = [bh[1] for bh in get_brand_heads()]
+            rows, errors = parse_expense_csv(csv_file, st.session_state.full_name, brand_head_names)
+            
+            if errors:
+                st.error(f"⚠️ {len(errors)} problem(s) found, nothing was imported:\n\n" + "\n".join(f"- {e}" for e in errors[:20]))
+            elif rows:
+                st.info(f"📌 {len(rows)} expense(s) ready to import")
+                if st.button("✅ Import Expenses", type="primary", key="bulk_import"):
+                    add_expenses_bulk(rows)
+                    # New uploader key so the same file isn't offered for import again
+                    st.session_state.bulk_upload_key = upload_key + 1
+                    flash_toast(f"✅ {len(rows)} expense(s) have been added successfully!", icon="✅")
+                    st.rerun()
+            else:
+                st.warning("⚠️ The file has no expense rows")
 
 # Page 2: My Expenses (HR View)
 elif page_clean == "My Expenses":
     st.header("📝 My Submitted Expenses")
     
-    my_expenses = get_expenses_by_user(st.session_state.full_name)
+    db_version = get_db_version()
+    summary = get_user_expense_summary(db_version, st.session_state.full_name)
     
-    if not my_expenses.empty:
-        my_expenses['Overall_Status'] = my_expenses.apply(get_overall_status, axis=1)
-        my_expenses['Category_Display'] = my_expenses.apply(get_category_display, axis=1)
-        
+    if summary['count']:
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("💰 Total Amount", f"₹{my_expenses['amount'].sum():,.2f}")
-        col2.metric("📝 Total Expenses", len(my_expenses))
-        col3.metric("⏳ Pending", len(my_expenses[my_expenses['stage1_status'] == 'Pending']))
-        col4.metric("✅ Paid", len(my_expenses[my_expenses['stage3_status'] == 'Paid']))
+        col1.metric("💰 Total Amount", f"₹{summary['total']:,.2f}")
+        col2.metric("📝 Total Expenses", summary['count'])
+        col3.metric("⏳ Pending", summary['pending'])
+        col4.metric("✅ Paid", summary['paid'])
         
         st.markdown("---")
         
+        # Metrics come from SQL, so only the current page of expenses is read and rendered
+        offset = page_offset(summary['count'], key="my_expenses_page")
+        my_expenses = get_expenses_by_user(db_version, st.session_state.full_name, limit=PAGE_SIZE, offset=offset)
+        my_expenses['Overall_Status'] = get_overall_status(my_expenses)
+        my_expenses['Category_Display'] = get_category_display(my_expenses)
+        
         # Display each expense with detailed status
-        for idx, row in my_expenses.iterrows():
+        for row in my_expenses.to_dict('records'):
             status_display = get_stage_status_display(row)
             
             with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
@@ -917,13 +1635,7 @@ elif page_clean == "My Expenses":
                     with col1:
                         st.success(f"✅ Document uploaded: **{row['bill_filename']}**")
                     with col2:
-                        if st.download_button(
-                            label="📥 Download",
-                            data=row['bill_document'],
-                            file_name=row['bill_filename'],
-                            mime=row['bill_filetype'],
-                            key=f"my_download_bill_{row['id']}"
-                        ):
+                        if render_bill_download(row, f"my_download_bill_{row['id']}", label="📥 Download"):
                             st.success("Downloaded!")
                 else:
                     st.info("ℹ️ No bill/document uploaded yet")
@@ -937,10 +1649,9 @@ elif page_clean == "My Expenses":
                 
                 if uploaded_bill is not None:
                     if st.button(f"💾 Save Bill", key=f"my_save_bill_{row['id']}", type="primary"):
-                        bill_data = uploaded_bill.read()
+                        bill_data = uploaded_bill.getvalue()
                         update_expense_bill(row['id'], bill_data, uploaded_bill.name, uploaded_bill.type)
-                        st.toast("✅ Bill has been uploaded successfully!", icon="✅")
-                        time.sleep(1)
+                        flash_toast("✅ Bill has been uploaded successfully!", icon="✅")
                         st.rerun()
                 
                 st.markdown("---")
@@ -1033,6 +1744,9 @@ elif page_clean == "My Expenses":
 elif "Approval Stage 1" in page_clean:
     st.header("✅ Approval Stage 1 - Brand Head Review")
     
+    # One fingerprint read shared by both tabs
+    db_version = get_db_version()
+    
     tab1, tab2 = st.tabs(["⏳ Approval Pending", "✅ Approved/Rejected"])
     
     with tab1:
@@ -1040,100 +1754,49 @@ elif "Approval Stage 1" in page_clean:
         
         # Brand heads only see expenses assigned to them
         if st.session_state.user_role == "brand_heads":
-            pending_expenses = get_expenses_for_approval(1, st.session_state.full_name)
+            pending_expenses = get_expenses_for_approval(db_version, 1, st.session_state.full_name)
         else:
             # Admin sees all
-            pending_expenses = get_expenses_for_approval(1)
+            pending_expenses = get_expenses_for_approval(db_version, 1)
         
         if not pending_expenses.empty:
-            pending_expenses['Category_Display'] = pending_expenses.apply(get_category_display, axis=1)
             st.info(f"📌 You have **{len(pending_expenses)}** expense(s) pending approval")
             
-            for idx, row in pending_expenses.iterrows():
-                status_display = get_stage_status_display(row)
-                
-                with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric("💰 Amount", f"₹{row['amount']:,.2f}")
-                    col2.metric("🏢 Brand", row['brand'])
-                    col3.metric("📂 Category", row['Category_Display'])
-                    
-                    st.markdown(f"**📝 Description:** {row['description']}")
-                    if pd.notna(row.get('vendor_name')) and row['vendor_name']:
-                        st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
-                    if pd.notna(row.get('due_date')) and row['due_date']:
-                        st.markdown(f"**📆 Due Date:** {row['due_date']}")
-                    st.markdown(f"**👤 Submitted By:** {row['added_by']}")
-                    if pd.notna(row.get('stage1_assigned_to')):
-                        st.markdown(f"**👨‍💼 Assigned To:** {row['stage1_assigned_to']}")
-                    st.markdown(f"**📅 Submitted On:** {row['created_at']}")
-                    
-                    # Show bill if available
-                    if pd.notna(row.get('bill_filename')):
-                        st.markdown("---")
-                        st.markdown("### 📎 Attached Bill/Document")
-                        col1, col2 = st.columns([2, 1])
-                        with col1:
-                            st.success(f"✅ **{row['bill_filename']}**")
-                        with col2:
-                            st.download_button(
-                                label="📥 View Bill",
-                                data=row['bill_document'],
-                                file_name=row['bill_filename'],
-                                mime=row['bill_filetype'],
-                                key=f"s1_view_bill_{row['id']}"
-                            )
-                    else:
-                        st.info("ℹ️ No bill attached")
-                    
-                    st.markdown("---")
-                    remarks = st.text_area("💬 Remarks", key=f"remarks_s1_{row['id']}")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.button("✅ Approve", key=f"approve_s1_{row['id']}", type="primary", use_container_width=True):
-                            approve_expense_stage1(row['id'], st.session_state.full_name, 'Approved', remarks)
-                            st.toast("✅ Expense has been approved successfully!", icon="✅")
-                            time.sleep(1)
-                            st.rerun()
-                    
-                    with col2:
-                        if st.button("❌ Reject", key=f"reject_s1_{row['id']}", use_container_width=True):
-                            if remarks:
-                                approve_expense_stage1(row['id'], st.session_state.full_name, 'Rejected', remarks)
-                                st.toast("❌ Expense has been rejected successfully!", icon="❌")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                st.warning("⚠️ Please provide remarks for rejection")
+            # Only build widgets for the current page of the queue
+            page_expenses = paginate(pending_expenses, key="s1_pending_page")
+            page_expenses['Category_Display'] = get_category_display(page_expenses)
+            
+            render_bulk_approval(1, page_expenses)
+            
+            # Plain dicts avoid building a Series per pending card
+            for row in page_expenses.to_dict('records'):
+                render_stage1_pending_row(row)
         else:
             st.success("✅ No pending approvals!")
     
     with tab2:
         st.subheader("My Approval History")
         
-        approved_expenses = get_approved_expenses_by_user(st.session_state.full_name, 1)
+        history = get_approval_history_summary(db_version, st.session_state.full_name, 1)
         
-        if not approved_expenses.empty:
-            # overall status and category display
-            approved_expenses['Overall_Status'] = approved_expenses.apply(get_overall_status, axis=1)
-            approved_expenses['Category_Display'] = approved_expenses.apply(get_category_display, axis=1)
-            
+        if history['count']:
             # Summary 
             col1, col2, col3, col4 = st.columns(4)
-            total_approved = len(approved_expenses[approved_expenses['stage1_status'] == 'Approved'])
-            total_rejected = len(approved_expenses[approved_expenses['stage1_status'] == 'Rejected'])
-            amount_approved = approved_expenses[approved_expenses['stage1_status'] == 'Approved']['amount'].sum()
-            
-            col1.metric("✅ Approved", total_approved)
-            col2.metric("❌ Rejected", total_rejected)
-            col3.metric("💰 Amount Approved", f"₹{amount_approved:,.2f}")
-            col4.metric("📝 Total Reviewed", len(approved_expenses))
+            col1.metric("✅ Approved", history['accepted'])
+            col2.metric("❌ Rejected", history['rejected'])
+            col3.metric("💰 Amount Approved", f"₹{history['accepted_amount']:,.2f}")
+            col4.metric("📝 Total Reviewed", history['count'])
             
             st.markdown("---")
             
+            offset = page_offset(history['count'], key="s1_history_page")
+            approved_expenses = get_approved_expenses_by_user(db_version, st.session_state.full_name, 1, limit=PAGE_SIZE, offset=offset)
+            # overall status and category display
+            approved_expenses['Overall_Status'] = get_overall_status(approved_expenses)
+            approved_expenses['Category_Display'] = get_category_display(approved_expenses)
+            
             # Display table
-            for idx, row in approved_expenses.iterrows():
+            for row in approved_expenses.to_dict('records'):
                 status_display = get_stage_status_display(row)
                 
                 with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
@@ -1169,107 +1832,52 @@ elif "Approval Stage 1" in page_clean:
 elif "Approval Stage 2" in page_clean:
     st.header("✅ Approval Stage 2 - Senior Manager Review")
     
+    db_version = get_db_version()
+    
     tab1, tab2 = st.tabs(["⏳ Approval Pending", "✅ Approved/Rejected"])
     
     with tab1:
         st.subheader("Expenses Pending Your Approval")
         
-        pending_expenses = get_expenses_for_approval(2)
+        pending_expenses = get_expenses_for_approval(db_version, 2)
         
         if not pending_expenses.empty:
-            pending_expenses['Category_Display'] = pending_expenses.apply(get_category_display, axis=1)
             st.info(f"📌 You have **{len(pending_expenses)}** expense(s) pending approval")
             
-            for idx, row in pending_expenses.iterrows():
-                status_display = get_stage_status_display(row)
-                
-                with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric("💰 Amount", f"₹{row['amount']:,.2f}")
-                    col2.metric("🏢 Brand", row['brand'])
-                    col3.metric("📂 Category", row['Category_Display'])
-                    
-                    st.markdown(f"**📝 Description:** {row['description']}")
-                    if pd.notna(row.get('vendor_name')) and row['vendor_name']:
-                        st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
-                    if pd.notna(row.get('due_date')) and row['due_date']:
-                        st.markdown(f"**📆 Due Date:** {row['due_date']}")
-                    st.markdown(f"**👤 Submitted By:** {row['added_by']}")
-                    st.markdown(f"**📅 Expense Date:** {row['date']}")
-                    
-                    # Show bill if available
-                    if pd.notna(row.get('bill_filename')):
-                        st.markdown("---")
-                        st.markdown("### 📎 Attached Bill/Document")
-                        col1, col2 = st.columns([2, 1])
-                        with col1:
-                            st.success(f"✅ **{row['bill_filename']}**")
-                        with col2:
-                            st.download_button(
-                                label="📥 View Bill",
-                                data=row['bill_document'],
-                                file_name=row['bill_filename'],
-                                mime=row['bill_filetype'],
-                                key=f"s2_view_bill_{row['id']}"
-                            )
-                    else:
-                        st.info("ℹ️ No bill attached")
-                    
-                    st.markdown("---")
-                    st.markdown("**Stage 1 Approval:**")
-                    st.markdown(f"- ✅ Approved by: {row['stage1_approved_by']}")
-                    st.markdown(f"- 📅 Approved on: {row['stage1_approved_date']}")
-                    if pd.notna(row.get('stage1_remarks')) and row['stage1_remarks']:
-                        st.markdown(f"- 💬 Remarks: {row['stage1_remarks']}")
-                    
-                    st.markdown("---")
-                    remarks = st.text_area("💬 Remarks", key=f"remarks_s2_{row['id']}")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.button("✅ Approve", key=f"approve_s2_{row['id']}", type="primary", use_container_width=True):
-                            approve_expense_stage2(row['id'], st.session_state.full_name, 'Approved', remarks)
-                            st.toast("✅ Expense has been approved successfully!", icon="✅")
-                            time.sleep(1)
-                            st.rerun()
-                    
-                    with col2:
-                        if st.button("❌ Reject", key=f"reject_s2_{row['id']}", use_container_width=True):
-                            if remarks:
-                                approve_expense_stage2(row['id'], st.session_state.full_name, 'Rejected', remarks)
-                                st.toast("❌ Expense has been rejected successfully!", icon="❌")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                st.warning("⚠️ Please provide remarks for rejection")
+            # Only build widgets for the current page of the queue
+            page_expenses = paginate(pending_expenses, key="s2_pending_page")
+            page_expenses['Category_Display'] = get_category_display(page_expenses)
+            
+            render_bulk_approval(2, page_expenses)
+            
+            for row in page_expenses.to_dict('records'):
+                render_stage2_pending_row(row)
         else:
             st.success("✅ No pending approvals!")
     
     with tab2:
         st.subheader("My Approval History")
         
-        approved_expenses = get_approved_expenses_by_user(st.session_state.full_name, 2)
+        history = get_approval_history_summary(db_version, st.session_state.full_name, 2)
         
-        if not approved_expenses.empty:
-            # Add overall status and category display
-            approved_expenses['Overall_Status'] = approved_expenses.apply(get_overall_status, axis=1)
-            approved_expenses['Category_Display'] = approved_expenses.apply(get_category_display, axis=1)
-            
+        if history['count']:
             # Summary 
             col1, col2, col3, col4 = st.columns(4)
-            total_approved = len(approved_expenses[approved_expenses['stage2_status'] == 'Approved'])
-            total_rejected = len(approved_expenses[approved_expenses['stage2_status'] == 'Rejected'])
-            amount_approved = approved_expenses[approved_expenses['stage2_status'] == 'Approved']['amount'].sum()
-            
-            col1.metric("✅ Approved", total_approved)
-            col2.metric("❌ Rejected", total_rejected)
-            col3.metric("💰 Amount Approved", f"₹{amount_approved:,.2f}")
-            col4.metric("📝 Total Reviewed", len(approved_expenses))
+            col1.metric("✅ Approved", history['accepted'])
+            col2.metric("❌ Rejected", history['rejected'])
+            col3.metric("💰 Amount Approved", f"₹{history['accepted_amount']:,.2f}")
+            col4.metric("📝 Total Reviewed", history['count'])
             
             st.markdown("---")
             
+            offset = page_offset(history['count'], key="s2_history_page")
+            approved_expenses = get_approved_expenses_by_user(db_version, st.session_state.full_name, 2, limit=PAGE_SIZE, offset=offset)
+            # Add overall status and category display
+            approved_expenses['Overall_Status'] = get_overall_status(approved_expenses)
+            approved_expenses['Category_Display'] = get_category_display(approved_expenses)
+            
             # table
-            for idx, row in approved_expenses.iterrows():
+            for row in approved_expenses.to_dict('records'):
                 status_display = get_stage_status_display(row)
                 
                 with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
@@ -1309,114 +1917,48 @@ elif "Approval Stage 2" in page_clean:
 elif "Approval Stage 3" in page_clean:
     st.header("💳 Approval Stage 3 - Accounts Payment Processing")
     
+    db_version = get_db_version()
+    
     tab1, tab2 = st.tabs(["⏳ Payment Pending", "✅ Paid/Rejected"])
     
     with tab1:
         st.subheader("Expenses Ready for Payment")
         
-        pending_expenses = get_expenses_for_approval(3)
+        pending_expenses = get_expenses_for_approval(db_version, 3)
         
         if not pending_expenses.empty:
-            pending_expenses['Category_Display'] = pending_expenses.apply(get_category_display, axis=1)
             st.info(f"📌 You have **{len(pending_expenses)}** expense(s) ready for payment")
             
-            for idx, row in pending_expenses.iterrows():
-                status_display = get_stage_status_display(row)
-                
-                with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric("💰 Amount to Pay", f"₹{row['amount']:,.2f}")
-                    col2.metric("🏢 Brand", row['brand'])
-                    col3.metric("📂 Category", row['Category_Display'])
-                    
-                    st.markdown(f"**📝 Description:** {row['description']}")
-                    if pd.notna(row.get('vendor_name')) and row['vendor_name']:
-                        st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
-                    if pd.notna(row.get('due_date')) and row['due_date']:
-                        st.markdown(f"**📆 Due Date:** {row['due_date']}")
-                    st.markdown(f"**👤 Submitted By:** {row['added_by']}")
-                    st.markdown(f"**📅 Expense Date:** {row['date']}")
-                    
-                    # Show bill if available
-                    if pd.notna(row.get('bill_filename')):
-                        st.markdown("---")
-                        st.markdown("### 📎 Attached Bill/Document")
-                        col1, col2 = st.columns([2, 1])
-                        with col1:
-                            st.success(f"✅ **{row['bill_filename']}**")
-                        with col2:
-                            st.download_button(
-                                label="📥 View Bill",
-                                data=row['bill_document'],
-                                file_name=row['bill_filename'],
-                                mime=row['bill_filetype'],
-                                key=f"s3_view_bill_{row['id']}"
-                            )
-                    else:
-                        st.info("ℹ️ No bill attached")
-                    
-                    st.markdown("---")
-                    st.markdown("**✅ Approval Status:**")
-                    st.markdown(f"- Stage 1: ✅ Approved by {row['stage1_approved_by']} on {row['stage1_approved_date']}")
-                    st.markdown(f"- Stage 2: ✅ Approved by {row['stage2_approved_by']} on {row['stage2_approved_date']}")
-                    
-                    st.markdown("---")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        payment_mode = st.selectbox("💳 Payment Mode", PAYMENT_MODES, key=f"pm_{row['id']}")
-                        transaction_ref = st.text_input("🔢 Transaction Reference/Cheque No.", key=f"tr_{row['id']}")
-                    
-                    with col2:
-                        remarks = st.text_area("💬 Payment Remarks", key=f"remarks_s3_{row['id']}")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.button("💰 Mark as Paid", key=f"paid_{row['id']}", type="primary", use_container_width=True):
-                            if transaction_ref:
-                                approve_expense_stage3(row['id'], st.session_state.full_name, 'Paid', 
-                                                     payment_mode, transaction_ref, remarks)
-                                st.toast("✅ Expense has been paid successfully!", icon="✅")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                st.warning("⚠️ Please provide transaction reference")
-                    
-                    with col2:
-                        if st.button("❌ Reject Payment", key=f"reject_s3_{row['id']}", use_container_width=True):
-                            if remarks:
-                                approve_expense_stage3(row['id'], st.session_state.full_name, 'Rejected', 
-                                                     None, None, remarks)
-                                st.toast("❌ Payment has been rejected successfully!", icon="❌")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                st.warning("⚠️ Please provide remarks for rejection")
+            # Only build widgets for the current page of the queue
+            page_expenses = paginate(pending_expenses, key="s3_pending_page")
+            page_expenses['Category_Display'] = get_category_display(page_expenses)
+            
+            for row in page_expenses.to_dict('records'):
+                render_stage3_pending_row(row)
         else:
             st.success("✅ No pending payments!")
     
     with tab2:
         st.subheader("Payment History")
         
-        payment_history = get_approved_expenses_by_user(st.session_state.full_name, 3)
+        history = get_approval_history_summary(db_version, st.session_state.full_name, 3)
         
-        if not payment_history.empty:
-            payment_history['Category_Display'] = payment_history.apply(get_category_display, axis=1)
-            
+        if history['count']:
             # Summary metrics
             col1, col2, col3, col4 = st.columns(4)
-            total_paid = len(payment_history[payment_history['stage3_status'] == 'Paid'])
-            total_rejected = len(payment_history[payment_history['stage3_status'] == 'Rejected'])
-            amount_paid = payment_history[payment_history['stage3_status'] == 'Paid']['amount'].sum()
-            
-            col1.metric("💰 Paid", total_paid)
-            col2.metric("❌ Rejected", total_rejected)
-            col3.metric("💵 Total Amount Paid", f"₹{amount_paid:,.2f}")
-            col4.metric("📝 Total Processed", len(payment_history))
+            col1.metric("💰 Paid", history['accepted'])
+            col2.metric("❌ Rejected", history['rejected'])
+            col3.metric("💵 Total Amount Paid", f"₹{history['accepted_amount']:,.2f}")
+            col4.metric("📝 Total Processed", history['count'])
             
             st.markdown("---")
             
+            offset = page_offset(history['count'], key="s3_history_page")
+            payment_history = get_approved_expenses_by_user(db_version, st.session_state.full_name, 3, limit=PAGE_SIZE, offset=offset)
+            payment_history['Category_Display'] = get_category_display(payment_history)
+            
             # Display table
-            for idx, row in payment_history.iterrows():
+            for row in payment_history.to_dict('records'):
                 status_display = get_stage_status_display(row)
                 
                 with st.expander(f"ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {status_display}"):
@@ -1454,12 +1996,10 @@ elif "Approval Stage 3" in page_clean:
 elif page_clean == "Dashboard":
     st.header("📊 Dashboard Overview")
     
-    df = get_all_expenses()
+    db_version = get_db_version()
+    filter_options, (min_date, max_date) = get_expense_filter_options(db_version)
     
-    if not df.empty:
-        df['Overall_Status'] = df.apply(get_overall_status, axis=1)
-        df['Category_Display'] = df.apply(get_category_display, axis=1)
-        
+    if filter_options:
         # Filters Section
         st.subheader("🔍 Filters")
         
@@ -1467,26 +2007,25 @@ elif page_clean == "Dashboard":
         
         with col1:
             # Brand filter
-            all_brands = ["All"] + sorted(df['brand'].unique().tolist())
+            all_brands = filter_options['brands']
             selected_brand = st.selectbox("🏢 Brand", all_brands, key="dash_brand_filter")
         
         with col2:
             # Status filter
-            status_options = ["All", "Stage 1 Pending", "Stage 2 Pending", "Payment Pending", "Paid", "Rejected"]
+            status_options = ["All"] + list(STATUS_FILTERS.keys())
             selected_status = st.selectbox("📊 Status", status_options, key="dash_status_filter")
         
         with col3:
             # Category filter
-            all_categories = ["All"] + sorted(df['category'].unique().tolist())
+            all_categories = filter_options['categories']
             selected_category = st.selectbox("📂 Category", all_categories, key="dash_category_filter")
         
         with col4:
             # Subcategory filter (based on selected category)
             if selected_category != "All":
-                filtered_subcats = df[df['category'] == selected_category]['subcategory'].dropna().unique().tolist()
-                all_subcategories = ["All"] + sorted(filtered_subcats) if filtered_subcats else ["All"]
+                all_subcategories = filter_options['subcategories'].get(selected_category, ["All"])
             else:
-                all_subcategories = ["All"] + sorted(df['subcategory'].dropna().unique().tolist())
+                all_subcategories = filter_options['all_subcategories']
             selected_subcategory = st.selectbox("📑 Subcategory", all_subcategories, key="dash_subcat_filter")
         
         with col5:
@@ -1494,88 +2033,49 @@ elif page_clean == "Dashboard":
             date_filter = st.selectbox("📅 Date Range", ["All Time", "Custom Range"], key="dash_date_filter")
         
         # Date range picker (if custom selected)
+        start_date = end_date = None
         if date_filter == "Custom Range":
             col_date1, col_date2 = st.columns(2)
             with col_date1:
-                start_date = st.date_input("Start Date", value=pd.to_datetime(df['date'].min()), key="dash_start_date")
+                start_date = st.date_input("Start Date", value=pd.to_datetime(min_date), key="dash_start_date")
             with col_date2:
-                end_date = st.date_input("End Date", value=pd.to_datetime(df['date'].max()), key="dash_end_date")
+                end_date = st.date_input("End Date", value=pd.to_datetime(max_date), key="dash_end_date")
         
         st.markdown("---")
         
-        # Apply filters
-        filtered_df = df.copy()
-        
-        if selected_brand != "All":
-            filtered_df = filtered_df[filtered_df['brand'] == selected_brand]
-        
-        if selected_status != "All":
-            if selected_status == "Stage 1 Pending":
-                filtered_df = filtered_df[filtered_df['stage1_status'] == 'Pending']
-            elif selected_status == "Stage 2 Pending":
-                filtered_df = filtered_df[
-                    (filtered_df['stage1_status'] == 'Approved') & 
-                    (filtered_df['stage2_status'] == 'Pending')
-                ]
-            elif selected_status == "Payment Pending":
-                filtered_df = filtered_df[
-                    (filtered_df['stage1_status'] == 'Approved') & 
-                    (filtered_df['stage2_status'] == 'Approved') & 
-                    (filtered_df['stage3_status'] == 'Pending')
-                ]
-            elif selected_status == "Paid":
-                filtered_df = filtered_df[filtered_df['stage3_status'] == 'Paid']
-            elif selected_status == "Rejected":
-                filtered_df = filtered_df[
-                    (filtered_df['stage1_status'] == 'Rejected') | 
-                    (filtered_df['stage2_status'] == 'Rejected') | 
-                    (filtered_df['stage3_status'] == 'Rejected')
-                ]
-        
-        if selected_category != "All":
-            filtered_df = filtered_df[filtered_df['category'] == selected_category]
-        
-        if selected_subcategory != "All":
-            filtered_df = filtered_df[filtered_df['subcategory'] == selected_subcategory]
-        
-        if date_filter == "Custom Range":
-            filtered_df['date'] = pd.to_datetime(filtered_df['date'])
-            filtered_df = filtered_df[
-                (filtered_df['date'] >= pd.to_datetime(start_date)) & 
-                (filtered_df['date'] <= pd.to_datetime(end_date))
-            ]
+        # Apply filters in SQL
+        filters = dict(
+            brands=[selected_brand] if selected_brand != "All" else None,
+            categories=[selected_category] if selected_category != "All" else None,
+            subcategories=[selected_subcategory] if selected_subcategory != "All" else None,
+            statuses=[selected_status] if selected_status != "All" else None,
+            date_from=start_date,
+            date_to=end_date
+        )
+        metrics, totals = get_dashboard_summary(db_version, **filters)
         
         # Display metrics for filtered data
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("💵 Total Expenses", f"₹{filtered_df['amount'].sum():,.2f}")
-        col2.metric("📝 Total Transactions", len(filtered_df))
-        col3.metric("✅ Paid", len(filtered_df[filtered_df['stage3_status'] == 'Paid']))
-        col4.metric("⏳ Pending", len(filtered_df[filtered_df['stage3_status'] == 'Pending']))
+        col1.metric("💵 Total Expenses", f"₹{metrics['total']:,.2f}")
+        col2.metric("📝 Total Transactions", metrics['count'])
+        col3.metric("✅ Paid", metrics['paid'])
+        col4.metric("⏳ Pending", metrics['pending'])
         
         st.markdown("---")
         
-        if not filtered_df.empty:
+        if metrics['count']:
+            brand_chart, category_chart = build_dashboard_charts(totals['brand'], totals['category'])
+            
             # Charts in two columns
             col1, col2 = st.columns(2)
             
             with col1:
                 # Brand summary chart
-                brand_summary = filtered_df.groupby('brand')['amount'].sum().reset_index()
-                brand_summary = brand_summary.nlargest(10, 'amount')
-                
-                fig = px.bar(brand_summary, x='brand', y='amount', 
-                            title='Top 10 Brands by Expense',
-                            labels={'amount': 'Amount (₹)', 'brand': 'Brand'})
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(pio.from_json(brand_chart), use_container_width=True)
             
             with col2:
                 # Category summary chart
-                category_summary = filtered_df.groupby('category')['amount'].sum().reset_index()
-                category_summary = category_summary.nlargest(10, 'amount')
-                
-                fig = px.pie(category_summary, values='amount', names='category',
-                            title='Expense Distribution by Category')
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(pio.from_json(category_chart), use_container_width=True)
         else:
             st.info("📌 No expenses match the selected filters.")
     else:
@@ -1589,20 +2089,12 @@ elif page_clean == "View All Expenses":
     else:
         st.header("📋 All Expenses")
     
-    # Get expenses based on user role
-    if st.session_state.user_role == "brand_heads":
-        # Brand heads only see expenses assigned to them
-        df = get_all_expenses()
-        if not df.empty:
-            df = df[df['stage1_assigned_to'] == st.session_state.full_name]
-    else:
-        # Other roles see all expenses
-        df = get_all_expenses()
+    # Brand heads only see expenses assigned to them, other roles see all expenses
+    assigned_to = st.session_state.full_name if st.session_state.user_role == "brand_heads" else None
+    db_version = get_db_version()
+    filter_options, (min_date, max_date) = get_expense_filter_options(db_version, assigned_to)
     
-    if not df.empty:
-        df['Overall_Status'] = df.apply(get_overall_status, axis=1)
-        df['Category_Display'] = df.apply(get_category_display, axis=1)
-        
+    if filter_options:
         # Filters Section
         st.subheader("🔍 Filters")
         
@@ -1610,26 +2102,25 @@ elif page_clean == "View All Expenses":
         
         with col1:
             # Brand filter
-            all_brands = ["All"] + sorted(df['brand'].unique().tolist())
+            all_brands = filter_options['brands']
             selected_brand = st.selectbox("🏢 Brand", all_brands, key="view_brand_filter")
         
         with col2:
             # Status filter
-            status_options = ["All", "Stage 1 Pending", "Stage 2 Pending", "Payment Pending", "Paid", "Rejected"]
+            status_options = ["All"] + list(STATUS_FILTERS.keys())
             selected_status = st.selectbox("📊 Status", status_options, key="view_status_filter")
         
         with col3:
             # Category filter
-            all_categories = ["All"] + sorted(df['category'].unique().tolist())
+            all_categories = filter_options['categories']
             selected_category = st.selectbox("📂 Category", all_categories, key="view_category_filter")
         
         with col4:
             # Subcategory filter (based on selected category)
             if selected_category != "All":
-                filtered_subcats = df[df['category'] == selected_category]['subcategory'].dropna().unique().tolist()
-                all_subcategories = ["All"] + sorted(filtered_subcats) if filtered_subcats else ["All"]
+                all_subcategories = filter_options['subcategories'].get(selected_category, ["All"])
             else:
-                all_subcategories = ["All"] + sorted(df['subcategory'].dropna().unique().tolist())
+                all_subcategories = filter_options['all_subcategories']
             selected_subcategory = st.selectbox("📑 Subcategory", all_subcategories, key="view_subcat_filter")
         
         with col5:
@@ -1637,172 +2128,50 @@ elif page_clean == "View All Expenses":
             date_filter = st.selectbox("📅 Date Range", ["All Time", "Custom Range"], key="view_date_filter")
         
         # Date range picker (if custom selected)
+        start_date = end_date = None
         if date_filter == "Custom Range":
             col_date1, col_date2 = st.columns(2)
             with col_date1:
-                start_date = st.date_input("Start Date", value=pd.to_datetime(df['date'].min()), key="view_start_date")
+                start_date = st.date_input("Start Date", value=pd.to_datetime(min_date), key="view_start_date")
             with col_date2:
-                end_date = st.date_input("End Date", value=pd.to_datetime(df['date'].max()), key="view_end_date")
+                end_date = st.date_input("End Date", value=pd.to_datetime(max_date), key="view_end_date")
         
         st.markdown("---")
         
-        # Apply filters
-        filtered_df = df.copy()
-        
-        if selected_brand != "All":
-            filtered_df = filtered_df[filtered_df['brand'] == selected_brand]
-        
-        if selected_status != "All":
-            if selected_status == "Stage 1 Pending":
-                filtered_df = filtered_df[filtered_df['stage1_status'] == 'Pending']
-            elif selected_status == "Stage 2 Pending":
-                filtered_df = filtered_df[
-                    (filtered_df['stage1_status'] == 'Approved') & 
-                    (filtered_df['stage2_status'] == 'Pending')
-                ]
-            elif selected_status == "Payment Pending":
-                filtered_df = filtered_df[
-                    (filtered_df['stage1_status'] == 'Approved') & 
-                    (filtered_df['stage2_status'] == 'Approved') & 
-                    (filtered_df['stage3_status'] == 'Pending')
-                ]
-            elif selected_status == "Paid":
-                filtered_df = filtered_df[filtered_df['stage3_status'] == 'Paid']
-            elif selected_status == "Rejected":
-                filtered_df = filtered_df[
-                    (filtered_df['stage1_status'] == 'Rejected') | 
-                    (filtered_df['stage2_status'] == 'Rejected') | 
-                    (filtered_df['stage3_status'] == 'Rejected')
-                ]
-        
-        if selected_category != "All":
-            filtered_df = filtered_df[filtered_df['category'] == selected_category]
-        
-        if selected_subcategory != "All":
-            filtered_df = filtered_df[filtered_df['subcategory'] == selected_subcategory]
-        
-        if date_filter == "Custom Range":
-            filtered_df['date'] = pd.to_datetime(filtered_df['date'])
-            filtered_df = filtered_df[
-                (filtered_df['date'] >= pd.to_datetime(start_date)) & 
-                (filtered_df['date'] <= pd.to_datetime(end_date))
-            ]
+        # Apply filters in SQL
+        filters = dict(
+            brands=[selected_brand] if selected_brand != "All" else None,
+            categories=[selected_category] if selected_category != "All" else None,
+            subcategories=[selected_subcategory] if selected_subcategory != "All" else None,
+            statuses=[selected_status] if selected_status != "All" else None,
+            date_from=start_date,
+            date_to=end_date,
+            assigned_to=assigned_to
+        )
+        metrics = get_expense_metrics(db_version, **filters)
         
         # Display metrics
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("💵 Total", f"₹{filtered_df['amount'].sum():,.2f}")
-        col2.metric("📝 Count", len(filtered_df))
-        col3.metric("✅ Paid", len(filtered_df[filtered_df['stage3_status'] == 'Paid']))
-        col4.metric("📎 With Bills", len(filtered_df[filtered_df['bill_filename'].notna()]))
+        col1.metric("💵 Total", f"₹{metrics['total']:,.2f}")
+        col2.metric("📝 Count", metrics['count'])
+        col3.metric("✅ Paid", metrics['paid'])
+        col4.metric("📎 With Bills", metrics['with_bills'])
         
         st.markdown("---")
         
+        # Only fetch the rows on the visible page
+        col_rows, col_page = st.columns(2)
+        with col_rows:
+            rows_per_page = st.selectbox("Rows per page", [50, 200, 1000], key="view_rows_per_page")
+        with col_page:
+            offset = page_offset(metrics['count'], key="view_page", page_size=rows_per_page)
+        
+        filtered_df = get_expenses(db_version, **filters, limit=rows_per_page, offset=offset)
+        
         if not filtered_df.empty:
-            # Expandable view for each expense
-            st.subheader("📋 Detailed Expense Records")
-            
-            for idx, row in filtered_df.iterrows():
-                has_bill = pd.notna(row.get('bill_filename'))
-                bill_icon = "📎" if has_bill else "📄"
-                
-                with st.expander(f"{bill_icon} ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {row['Overall_Status']}"):
-                    col1, col2, col3, col4 = st.columns(4)
-                    col1.metric("💰 Amount", f"₹{row['amount']:,.2f}")
-                    col2.metric("🏢 Brand", row['brand'])
-                    col3.metric("📂 Category", row['Category_Display'])
-                    col4.metric("📊 Status", row['Overall_Status'])
-                    
-                    st.markdown(f"**📝 Description:** {row['description']}")
-                    if pd.notna(row.get('vendor_name')) and row['vendor_name']:
-                        st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
-                    if pd.notna(row.get('due_date')) and row['due_date']:
-                        st.markdown(f"**📆 Due Date:** {row['due_date']}")
-                    st.markdown(f"**👤 Submitted By:** {row['added_by']}")
-                    st.markdown(f"**📅 Expense Date:** {row['date']}")
-                    st.markdown(f"**🕐 Submitted On:** {row['created_at']}")
-                    
-                    if pd.notna(row.get('stage1_assigned_to')):
-                        st.markdown(f"**👨‍💼 Assigned To:** {row['stage1_assigned_to']}")
-                    
-                    st.markdown("---")
-                    
-                    # Bill/Document Section
-                    st.markdown("### 📎 Bill/Document")
-                    
-                    if has_bill:
-                        col1, col2 = st.columns([2, 1])
-                        with col1:
-                            st.success(f"✅ Document uploaded: **{row['bill_filename']}**")
-                        with col2:
-                            if st.download_button(
-                                label="📥 Download Bill",
-                                data=row['bill_document'],
-                                file_name=row['bill_filename'],
-                                mime=row['bill_filetype'],
-                                key=f"download_bill_{row['id']}"
-                            ):
-                                st.success("Downloaded!")
-                    else:
-                        st.info("ℹ️ No bill/document uploaded yet")
-                    
-                    # Allow uploading bill if not present 
-                    st.markdown("**Upload/Update Bill:**")
-                    uploaded_bill = st.file_uploader(
-                        "Upload Bill/Document (PDF or Image)", 
-                        type=['pdf', 'png', 'jpg', 'jpeg'],
-                        key=f"upload_bill_{row['id']}"
-                    )
-                    
-                    if uploaded_bill is not None:
-                        if st.button(f"💾 Save Bill", key=f"save_bill_{row['id']}", type="primary"):
-                            bill_data = uploaded_bill.read()
-                            update_expense_bill(row['id'], bill_data, uploaded_bill.name, uploaded_bill.type)
-                            st.toast("✅ Bill has been uploaded successfully!", icon="✅")
-                            time.sleep(1)
-                            st.rerun()
-                    
-                    st.markdown("---")
-                    
-                    # Approval Status
-                    st.markdown("### 📋 Approval Status")
-                    status_col1, status_col2, status_col3 = st.columns(3)
-                    
-                    with status_col1:
-                        st.markdown("**Stage 1: Brand Head**")
-                        if row['stage1_status'] == 'Approved':
-                            st.success("✅ Approved")
-                            st.caption(f"By: {row['stage1_approved_by']}")
-                        elif row['stage1_status'] == 'Rejected':
-                            st.error("❌ Rejected")
-                            st.caption(f"By: {row['stage1_approved_by']}")
-                        else:
-                            st.warning("⏳ Pending")
-                    
-                    with status_col2:
-                        st.markdown("**Stage 2: Senior Manager**")
-                        if row['stage2_status'] == 'Approved':
-                            st.success("✅ Approved")
-                            st.caption(f"By: {row['stage2_approved_by']}")
-                        elif row['stage2_status'] == 'Rejected':
-                            st.error("❌ Rejected")
-                            st.caption(f"By: {row['stage2_approved_by']}")
-                        else:
-                            st.warning("⏳ Pending")
-                    
-                    with status_col3:
-                        st.markdown("**Stage 3: Accounts**")
-                        if row['stage3_status'] == 'Paid':
-                            st.success("✅ Paid")
-                            st.caption(f"By: {row['stage3_paid_by']}")
-                            if pd.notna(row.get('stage3_payment_mode')):
-                                st.caption(f"Mode: {row['stage3_payment_mode']}")
-                        elif row['stage3_status'] == 'Rejected':
-                            st.error("❌ Rejected")
-                            st.caption(f"By: {row['stage3_paid_by']}")
-                        else:
-                            st.warning("⏳ Pending")
+            filtered_df['Overall_Status'] = get_overall_status(filtered_df)
+            filtered_df['Category_Display'] = get_category_display(filtered_df)
             
-            st.markdown("---")
             st.subheader("📊 Summary Table")
             
             display_df = filtered_df[[
@@ -1811,21 +2180,161 @@ elif page_clean == "View All Expenses":
             ]].copy()
             
             # Add bill status column
-            display_df['has_bill'] = filtered_df['bill_filename'].notna().apply(lambda x: '✅' if x else '❌')
+            display_df['has_bill'] = filtered_df['bill_filename'].notna().map({True: '✅', False: '❌'})
             
             # Add assigned_to column if it exists
             if 'stage1_assigned_to' in filtered_df.columns:
                 display_df.insert(6, 'assigned_to', filtered_df['stage1_assigned_to'])
             
-            st.dataframe(display_df, use_container_width=True, hide_index=True)
+            # Selections are row positions, so each distinct set of shown expenses gets its own table
+            # state: changing page, page size or filters clears the selection instead of moving it
+            # onto whichever expense now sits at that position
+            page_ids = hashlib.sha1(filtered_df['id'].to_numpy().tobytes()).hexdigest()
             
-            excel_data = to_excel(filtered_df)
-            st.download_button(
-                label="📥 Download Excel",
-                data=excel_data,
-                file_name=f"expenses_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            # Formatting is declared once per column and applied client-side; one table component
+            # serves the whole page and only the selected row gets the detail widgets below
+            table = st.dataframe(
+                display_df,
+                use_container_width=True,
+                hide_index=True,
+                key=f"view_table_{page_ids}",
+                on_select="rerun",
+                selection_mode="single-row",
+                column_config={
+                    'id': st.column_config.NumberColumn("ID", format="%d"),
+                    'date': st.column_config.DateColumn("Date", format="YYYY-MM-DD"),
+                    'brand': "Brand",
+                    'Category_Display': "Category",
+                    'amount': st.column_config.NumberColumn("Amount (₹)", format="₹%.2f"),
+                    'description': "Description",
+                    'assigned_to': "Assigned To",
+                    'stage1_status': "Brand Head",
+                    'stage2_status': "Senior Manager",
+                    'stage3_status': "Accounts",
+                    'Overall_Status': "Overall Status",
+                    'has_bill': st.column_config.TextColumn("Bill", width="small")
+                }
             )
+            
+            selected_rows = [i for i in table.selection.rows if i < len(filtered_df)]
+            if selected_rows:
+                row = filtered_df.iloc[selected_rows[0]]
+                has_bill = pd.notna(row.get('bill_filename'))
+                bill_icon = "📎" if has_bill else "📄"
+                
+                st.subheader(f"{bill_icon} ID: {row['id']} | {row['brand']} | {row['Category_Display']} | ₹{row['amount']:,.2f} | {row['Overall_Status']}")
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("💰 Amount", f"₹{row['amount']:,.2f}")
+                col2.metric("🏢 Brand", row['brand'])
+                col3.metric("📂 Category", row['Category_Display'])
+                col4.metric("📊 Status", row['Overall_Status'])
+                
+                st.markdown(f"**📝 Description:** {row['description']}")
+                if pd.notna(row.get('vendor_name')) and row['vendor_name']:
+                    st.markdown(f"**🏪 Vendor:** {row['vendor_name']}")
+                if pd.notna(row.get('due_date')) and row['due_date']:
+                    st.markdown(f"**📆 Due Date:** {row['due_date']}")
+                st.markdown(f"**👤 Submitted By:** {row['added_by']}")
+                st.markdown(f"**📅 Expense Date:** {row['date']}")
+                st.markdown(f"**🕐 Submitted On:** {row['created_at']}")
+                
+                if pd.notna(row.get('stage1_assigned_to')):
+                    st.markdown(f"**👨‍💼 Assigned To:** {row['stage1_assigned_to']}")
+                
+                st.markdown("---")
+                
+                # Bill/Document Section
+                st.markdown("### 📎 Bill/Document")
+                
+                if has_bill:
+                    col1, col2 = st.columns([2, 1])
+                    with col1:
+                        st.success(f"✅ Document uploaded: **{row['bill_filename']}**")
+                    with col2:
+                        if render_bill_download(row, f"download_bill_{row['id']}", label="📥 Download Bill"):
+                            st.success("Downloaded!")
+                else:
+                    st.info("ℹ️ No bill/document uploaded yet")
+                
+                # Allow uploading bill if not present 
+                st.markdown("**Upload/Update Bill:**")
+                uploaded_bill = st.file_uploader(
+                    "Upload Bill/Document (PDF or Image)", 
+                    type=['pdf', 'png', 'jpg', 'jpeg'],
+                    key=f"upload_bill_{row['id']}"
+                )
+                
+                if uploaded_bill is not None:
+                    if st.button(f"💾 Save Bill", key=f"save_bill_{row['id']}", type="primary"):
+                        bill_data = uploaded_bill.getvalue()
+                        update_expense_bill(row['id'], bill_data, uploaded_bill.name, uploaded_bill.type)
+                        flash_toast("✅ Bill has been uploaded successfully!", icon="✅")
+                        st.rerun()
+                
+                st.markdown("---")
+                
+                # Approval Status
+                st.markdown("### 📋 Approval Status")
+                status_col1, status_col2, status_col3 = st.columns(3)
+                
+                with status_col1:
+                    st.markdown("**Stage 1: Brand Head**")
+                    if row['stage1_status'] == 'Approved':
+                        st.success("✅ Approved")
+                        st.caption(f"By: {row['stage1_approved_by']}")
+                    elif row['stage1_status'] == 'Rejected':
+                        st.error("❌ Rejected")
+                        st.caption(f"By: {row['stage1_approved_by']}")
+                    else:
+                        st.warning("⏳ Pending")
+                
+                with status_col2:
+                    st.markdown("**Stage 2: Senior Manager**")
+                    if row['stage2_status'] == 'Approved':
+                        st.success("✅ Approved")
+                        st.caption(f"By: {row['stage2_approved_by']}")
+                    elif row['stage2_status'] == 'Rejected':
+                        st.error("❌ Rejected")
+                        st.caption(f"By: {row['stage2_approved_by']}")
+                    else:
+                        st.warning("⏳ Pending")
+                
+                with status_col3:
+                    st.markdown("**Stage 3: Accounts**")
+                    if row['stage3_status'] == 'Paid':
+                        st.success("✅ Paid")
+                        st.caption(f"By: {row['stage3_paid_by']}")
+                        if pd.notna(row.get('stage3_payment_mode')):
+                            st.caption(f"Mode: {row['stage3_payment_mode']}")
+                    elif row['stage3_status'] == 'Rejected':
+                        st.error("❌ Rejected")
+                        st.caption(f"By: {row['stage3_paid_by']}")
+                    else:
+                        st.warning("⏳ Pending")
+            else:
+                st.caption("👆 Select a row to see its details, bill and approval status")
+            
+            st.markdown("---")
+            
+            # Downloads cover every matching row, not just the current page, so only build them once asked to
+            export_key = repr((db_version, filters))
+            if st.session_state.get('view_export_key') == export_key or st.button("📦 Prepare Downloads", key="view_prepare_downloads"):
+                st.session_state.view_export_key = export_key
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button(
+                        label="📥 Download CSV",
+                        data=export_expenses(db_version, 'csv', **filters),
+                        file_name=f"expenses_{datetime.now().strftime('%Y%m%d')}.csv",
+                        mime="text/csv"
+                    )
+                with col2:
+                    st.download_button(
+                        label="📥 Download Excel",
+                        data=export_expenses(db_version, 'xlsx', **filters),
+                        file_name=f"expenses_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
         else:
             st.info("📌 No expenses match the selected filters.")
     else:
@@ -1887,7 +2396,7 @@ elif page_clean == "User Management":
             
             st.markdown("---")
             
-            for idx, user in users_df.iterrows():
+            for user in users_df.to_dict('records'):
                 status_icon = '✅' if user['is_active'] else '❌'
                 with st.expander(f"{status_icon} {user['full_name']} (@{user['username']}) - {USER_ROLES[user['role']]['title']}"):
                     col1, col2 = st.columns(2)
@@ -1993,9 +2502,8 @@ elif page_clean == "Change Password":
                 else:
                     success, message = change_password(st.session_state.username, current_password, new_password)
                     if success:
-                        st.success(f"✅ {message}")
-                        st.info("⚠️ All your sessions have been invalidated. Please login again.")
-                        time.sleep(2)
+                        flash_toast(f"✅ {message}", icon="✅")
+                        flash_toast("⚠️ All your sessions have been invalidated. Please login again.", icon="⚠️")
                         
                         # Logout user after password change
                         if 'auth_token' in st.session_state and st.session_state.auth_token:
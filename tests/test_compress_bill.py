@@ -0,0 +1,44 @@
+import ast
+import io
+import random
+from pathlib import Path
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageOps = pytest.importorskip("PIL.ImageOps")
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+
+def load_compress_bill():
+    """Load compress_bill from app.py without running the Streamlit script"""
+    source = APP_PATH.read_text(encoding="utf-8")
+    node = next(
+        node for node in ast.parse(source).body
+        if isinstance(node, ast.FunctionDef) and node.name == "compress_bill"
+    )
+    namespace = {"Image": Image, "ImageOps": ImageOps, "io": io}
+    exec(ast.get_source_segment(source, node), namespace)
+    return namespace["compress_bill"]
+
+
+def test_transparent_png_keeps_white_background():
+    compress_bill = load_compress_bill()
+    
+    # Noisy opaque right half so the PNG is well over the size threshold, fully transparent left half
+    size = 2000
+    img = Image.frombytes("RGB", (size, size), random.Random(0).randbytes(size * size * 3)).convert("RGBA")
+    alpha = Image.new("L", (size, size), 255)
+    alpha.paste(0, (0, 0, size // 2, size))
+    img.putalpha(alpha)
+    upload = io.BytesIO()
+    img.save(upload, format="PNG")
+    
+    stored, filename, filetype = compress_bill(upload.getvalue(), "scan.png", "image/png")
+    
+    assert (filename, filetype) == ("scan.jpg", "image/jpeg")
+    stored_img = Image.open(io.BytesIO(stored)).convert("RGB")
+    # Sample well inside the transparent half, away from JPEG ringing at the edge
+    for x, y in [(10, 10), (200, 700), (600, 1500)]:
+        assert all(channel >= 245 for channel in stored_img.getpixel((x, y)))